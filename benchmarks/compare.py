@@ -0,0 +1,44 @@
+import argparse
+import json
+import sys
+
+
+def load(file_path: str) -> dict:
+    with open(file_path, 'r', encoding='utf8') as file:
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares two reports of benchmarks.run')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--metric', default='p50_ms')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='a path is a regression when it is this many times slower or makes more storage calls')
+    args = parser.parse_args()
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline['meta']['world'] != current['meta']['world']:
+        print('warning: the reports were made with different worlds', file=sys.stderr)
+
+    regressions = 0
+    for backend, result in current['backends'].items():
+        old = baseline['backends'].get(backend, {})
+        if 'paths' not in result or 'paths' not in old:
+            continue
+        for path, stats in result['paths'].items():
+            if path not in old['paths']:
+                continue
+            before, after = old['paths'][path], stats
+            ratio = after[args.metric] / before[args.metric] if before[args.metric] > 0 else 1
+            ops_before, ops_after = sum(before['ops'].values()), sum(after['ops'].values())
+            flag = ''
+            if ratio > args.threshold or ops_after > ops_before * args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f'{backend:>7} {path:<18} {before[args.metric]:10.3f} -> {after[args.metric]:10.3f}ms '
+                  f'x{ratio:5.2f}  ops {ops_before:8.2f} -> {ops_after:8.2f}{flag}')
+    sys.exit(1 if regressions > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import contextlib
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from mcdreforged.api.all import *
+from ruamel.yaml import YAML
+
+LANG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lang', 'en_us.yml')
+
+
+def load_lang(file_path: str) -> Dict[str, str]:
+    with open(file_path, 'r', encoding='utf8') as file:
+        data = YAML(typ='safe').load(file)  # ruamel.yaml comes with mcdreforged
+    flat = {}
+
+    def walk(prefix: str, node: Any):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                walk(f'{prefix}.{key}' if prefix else key, value)
+        else:
+            flat[prefix] = str(node)
+
+    walk('', data)
+    return flat
+
+
+class FakeServer:
+    # the parts of PluginServerInterface the plugin uses, with every message kept in memory
+    def __init__(self, data_folder: str, config: Dict[str, Any], plugins: Dict[str, Any]):
+        self.data_folder = data_folder
+        self.config = config
+        self.plugins = plugins
+        self.logger = logging.getLogger('division.benchmark')
+        self.told: List[tuple] = []
+        self.said: List[Any] = []
+        self.commands: List[Any] = []
+        self.listeners: Dict[str, Callable] = {}
+        self.permission_levels: Dict[str, int] = {}
+        self._lang = load_lang(LANG_FILE)
+        os.makedirs(data_folder, exist_ok=True)
+
+    def install(self):
+        # tr() of the plugin goes through ServerInterface.get_instance()
+        ServerInterface._ServerInterface__global_instance = self
+
+    def rtr(self, translation_key: str, *args) -> RText:
+        text = self._lang.get(translation_key, translation_key)
+        try:
+            text = text.format(*args)
+        except (IndexError, KeyError, ValueError):
+            pass
+        return RText(text)
+
+    def get_data_folder(self) -> str:
+        return self.data_folder
+
+    def get_self_metadata(self):
+        return type('Metadata', (), {'name': 'Division', 'version': 'benchmark'})()
+
+    def get_plugin_instance(self, plugin_id: str) -> Optional[Any]:
+        return self.plugins.get(plugin_id)
+
+    def load_config_simple(self, file_name: str, target_class=None, **kwargs):
+        return target_class(**self.config)
+
+    def register_command(self, node):
+        self.commands.append(node)
+
+    def register_help_message(self, *args, **kwargs):
+        pass
+
+    def register_event_listener(self, event: str, callback: Callable):
+        self.listeners[event] = callback
+
+    def get_plugin_command_source(self) -> 'FakeConsoleSource':
+        return FakeConsoleSource(self)
+
+    def get_permission_level(self, player: str) -> int:
+        return self.permission_levels.get(player, 0)
+
+    def tell(self, player: str, msg, **kwargs):
+        self.told.append((player, msg))
+
+    def say(self, msg, **kwargs):
+        self.said.append(msg)
+
+
+class FakeConsoleSource(CommandSource):
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.replies: List[Any] = []
+
+    @property
+    def is_player(self) -> bool:
+        return False
+
+    @property
+    def is_console(self) -> bool:
+        return True
+
+    def get_server(self):
+        return self.server
+
+    def get_permission_level(self) -> int:
+        return 4
+
+    def get_preference(self):
+        return None
+
+    def preferred_language_context(self):
+        return contextlib.nullcontext()
+
+    def reply(self, message, **kwargs):
+        self.replies.append(message)
+
+    def __str__(self):
+        return 'Console'
+
+
+class FakePlayerSource(PlayerCommandSource):
+    def __init__(self, server: FakeServer, player: str, permission_level: int = 4):
+        self.server = server
+        self.player = player
+        self.permission_level = permission_level
+        self.replies: List[Any] = []
+
+    @property
+    def is_player(self) -> bool:
+        return True
+
+    @property
+    def is_console(self) -> bool:
+        return False
+
+    def get_server(self):
+        return self.server
+
+    def get_permission_level(self) -> int:
+        return self.permission_level
+
+    def get_preference(self):
+        return None
+
+    def preferred_language_context(self):
+        return contextlib.nullcontext()
+
+    def reply(self, message, **kwargs):
+        self.replies.append(message)
+
+
+class FakeOnlinePlayerApi:
+    def __init__(self, online: List[str]):
+        self.online = set(online)
+
+    def get_player_list(self) -> List[str]:
+        return sorted(self.online)
+
+    def check_online(self, player: str) -> bool:
+        return player in self.online
+
+    def is_player(self, player: str) -> bool:
+        return True
+
+    def get_player_ips(self, player: str) -> List[str]:
+        return []
+
+
+class FakePlayerIpLogger:
+    def __init__(self, ips: Dict[str, str]):
+        self.ips = ips
+
+    def is_player(self, player: str) -> bool:
+        return player in self.ips
+
+    def get_player_ips(self, player: str) -> List[str]:
+        return [self.ips[player]] if player in self.ips else []
@@ -0,0 +1,294 @@
+import argparse
+import functools
+import json
+import logging
+import math
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, List
+
+import division.entry as entry
+from division.constants import GROUP_OF_ALL
+from division.storage import redis_s, sqlite_s
+from division.storage.storage import Storage, GroupStorage, PlayerStorage, MembershipStorage, OtherStorage, \
+    build_membership_storage
+from benchmarks.fake_server import FakeServer, FakeConsoleSource, FakePlayerSource, FakeOnlinePlayerApi, \
+    FakePlayerIpLogger
+from benchmarks.world import World, WORDS
+
+BACKENDS = {
+    'direct': {'storage_format': 'json'},
+    'binary': {'storage_format': 'binary'},
+    'sqlite': {'storage_format': 'sqlite'},
+    'redis': {}
+}
+STORAGE_APIS = {
+    'group_storage': (Storage, GroupStorage),
+    'player_storage': (Storage, PlayerStorage),
+    'membership': (MembershipStorage,),
+    'other_storage': (OtherStorage,)
+}
+
+
+def unwrap(func: Callable) -> Callable:
+    return getattr(func, '__wrapped__', func)  # executor tasks are run in place
+
+
+class OpCounter:
+    # calls the plugin makes into the storage layer, calls a storage makes to itself are not counted again
+    def __init__(self):
+        self.ops: Counter = Counter()
+        self.queries = 0
+        self._local = threading.local()
+
+    def wrap(self, role: str, obj: Any, apis: tuple):
+        names = {name for api in apis for name, value in vars(api).items()
+                 if callable(value) and not name.startswith('_')}
+        for name in sorted(names):
+            method = getattr(obj, name, None)
+            if method is not None:
+                setattr(obj, name, self._counted(f'{role}.{name}', method))
+
+    def _counted(self, key: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrap(*args, **kwargs):
+            depth = getattr(self._local, 'depth', 0)
+            if depth == 0:
+                self.ops[key] += 1
+            self._local.depth = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+        return wrap
+
+    def count_query(self, *args):
+        self.queries += 1
+
+    def watch_redis(self):
+        # one round trip per plain command and per pipeline
+        counter = self
+
+        def counted(method):
+            @functools.wraps(method)
+            def wrap(*args, **kwargs):
+                counter.queries += 1
+                return method(*args, **kwargs)
+            return wrap
+
+        redis_s.rj.execute_command = counted(redis_s.rj.execute_command)
+        pipeline = redis_s.rj.pipeline
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            pipe.execute = counted(pipe.execute)
+            return pipe
+
+        redis_s.rj.pipeline = counted_pipeline
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]  # nearest rank
+
+
+class Bench:
+    def __init__(self, world: World, backend: str, args, workers: int = 1):
+        self.world = world
+        self.backend = backend
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.counter = OpCounter()
+        self.folder = tempfile.mkdtemp(prefix=f'division-bench-{backend}-')
+        config = dict(BACKENDS[backend], ip_timezone_file='ip_timezone.csv', worker_count=workers)
+        if backend == 'redis':
+            config.update(redis_ip=args.redis_host, redis_port=args.redis_port, redis_db=args.redis_db)
+        online = self.rng.sample(world.player_names, min(args.online, len(world.player_names)))
+        self.server = FakeServer(self.folder, config, {
+            'online_player_api': FakeOnlinePlayerApi(online),
+            'player_ip_logger': FakePlayerIpLogger(world.ips)
+        })
+        self.console = FakeConsoleSource(self.server)
+
+    def load(self) -> float:
+        self.server.install()
+        self.world.write_ip_timezones(self.folder, 'ip_timezone.csv')
+        if self.backend == 'redis':
+            from redis import Redis
+            Redis(self.args.redis_host, self.args.redis_port, db=self.args.redis_db).flushdb()
+        else:
+            self.world.write_snapshots(self.folder)
+        start = time.perf_counter()
+        entry.on_load(self.server, None)
+        if self.backend == 'redis':
+            # redis has no snapshot import, the world is written through the storage and indexed again
+            self.world.add_to(entry.player_storage, entry.group_storage)
+            redis_s.rj.delete('schema:membership')
+            entry.membership = build_membership_storage('redis')
+            for name, group in self.world.groups.items():
+                if GROUP_OF_ALL in group.list:
+                    entry.other_storage.add_group_for_all(name)
+            entry.presence.load(entry.player_storage)
+        elapsed = time.perf_counter() - start
+        for role, apis in STORAGE_APIS.items():
+            self.counter.wrap(role, getattr(entry, role), apis)
+        if self.backend == 'redis':
+            self.counter.watch_redis()
+        elif self.backend == 'sqlite':
+            sqlite_s.conn.set_trace_callback(self.counter.count_query)
+        return elapsed
+
+    def unload(self):
+        if self.backend == 'sqlite' and sqlite_s.conn is not None:
+            sqlite_s.conn.set_trace_callback(None)
+        entry.on_unload(self.server)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def player(self) -> str:
+        return self.rng.choice(self.world.player_names)
+
+    def group(self) -> str:
+        return self.rng.choice(self.world.group_names)
+
+    def pairs(self, count: int) -> List[tuple]:
+        # (group, player) pairs that aren't joined yet, so joining and then leaving them changes nothing
+        rst = []
+        while len(rst) < count:
+            group, player = self.group(), self.player()
+            if player not in self.world.groups[group].list and (group, player) not in rst:
+                rst.append((group, player))
+        return rst
+
+    def paths(self, count: int) -> Dict[str, Callable[[int], Any]]:
+        pages = max(1, len(self.world.group_names) // entry.config.item_per_page)
+        player_pages = max(1, len(self.world.player_names) // entry.config.item_per_page)
+        pairs = self.pairs(count)
+        no_all = [name for name, group in self.world.groups.items() if GROUP_OF_ALL not in group.list]
+        all_groups = [no_all[i % len(no_all)] for i in range(count)]
+        return OrderedDict([
+            ('info_group', lambda i: unwrap(entry.info)(self.console, self.group())),
+            ('info_player', lambda i: unwrap(entry.info)(self.console, self.player())),
+            ('check_msg', lambda i: unwrap(entry.check_msg)(self.source(), page=1)),
+            ('check_msg_all', lambda i: unwrap(entry.check_msg)(self.source())),
+            ('check_msg_unread', lambda i: unwrap(entry.check_msg)(self.source(), unread=True)),
+            ('list_items_list', lambda i: unwrap(entry.list_items)(
+                self.console, mode='list', page=self.rng.randint(1, pages))),
+            ('list_items_ids', lambda i: unwrap(entry.list_items)(
+                self.console, mode='ids', page=self.rng.randint(1, player_pages))),
+            ('list_items_search', lambda i: unwrap(entry.list_items)(
+                self.console, keyword=f'{self.rng.randint(0, 999):03d}')),
+            ('join_group', lambda i: unwrap(entry.join_group)(self.console, pairs[i][0], pairs[i][1])),
+            ('leave_group', lambda i: unwrap(entry.leave_group)(self.console, pairs[i][0], pairs[i][1])),
+            ('handle_join_all', lambda i: entry.handle_join_all(self.console, all_groups[i])),
+            ('handle_leave_all', lambda i: entry.handle_leave_all(self.console, all_groups[i])),
+            ('send_msg', lambda i: unwrap(entry.send_msg)(
+                self.source(), self.group(), ' '.join(self.rng.choice(WORDS) for _ in range(8)))),
+            ('login', lambda i: self.login()),
+        ])
+
+    def source(self) -> FakePlayerSource:
+        return FakePlayerSource(self.server, self.player())
+
+    def login(self):
+        name = self.player()
+        unwrap(entry.on_player_logged)(self.server, name, self.world.ips[name])
+
+    def run(self) -> Dict[str, Any]:
+        count = self.args.warmup + self.args.iterations
+        load_time = self.load()
+        results = OrderedDict()
+        try:
+            for name, path in self.paths(count).items():
+                if self.args.paths and name not in self.args.paths:
+                    continue
+                for i in range(self.args.warmup):
+                    path(i)
+                self.counter.ops.clear()
+                self.counter.queries = 0
+                times = []
+                for i in range(self.args.warmup, count):
+                    start = time.perf_counter()
+                    path(i)
+                    times.append((time.perf_counter() - start) * 1000)
+                results[name] = {
+                    'p50_ms': round(percentile(times, 50), 4),
+                    'p90_ms': round(percentile(times, 90), 4),
+                    'p99_ms': round(percentile(times, 99), 4),
+                    'max_ms': round(max(times), 4),
+                    'mean_ms': round(statistics.fmean(times), 4),
+                    'ops': {key: round(value / len(times), 3) for key, value in sorted(self.counter.ops.items())},
+                    'queries': round(self.counter.queries / len(times), 3)
+                }
+                log(f'{self.backend:>7} {name:<18} p50 {results[name]["p50_ms"]:9.3f}ms  '
+                    f'p99 {results[name]["p99_ms"]:9.3f}ms  ops {sum(results[name]["ops"].values()):7.2f}')
+        finally:
+            self.unload()
+        return {'load_s': round(load_time, 3), 'paths': results}
+
+
+def log(text: str):
+    print(text, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the command paths of the plugin against synthetic worlds')
+    parser.add_argument('-b', '--backend', action='append', choices=list(BACKENDS),
+                        help='storage to run against, can be given more than once (default: direct and redis)')
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--groups-per-player', type=int, default=5)
+    parser.add_argument('--online', type=int, default=50, help='players reported online')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('-p', '--path', dest='paths', action='append', help='only run these paths')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--redis-host', default='127.0.0.1')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-db', type=int, default=15, help='flushed before the run')
+    parser.add_argument('-o', '--output', help='write the json report here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show what the plugin logs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    start = time.perf_counter()
+    world = World(args.players, args.groups, args.messages, args.groups_per_player, seed=args.seed)
+    log(f'world of {args.players} players, {args.groups} groups and {args.messages} messages '
+        f'made in {time.perf_counter() - start:.1f}s')
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'world': {'players': args.players, 'groups': args.groups, 'messages': args.messages,
+                      'groups_per_player': args.groups_per_player, 'online': args.online, 'seed': args.seed},
+            'iterations': args.iterations,
+            'warmup': args.warmup
+        },
+        'backends': OrderedDict()
+    }
+    for backend in args.backend or ['direct', 'redis']:
+        try:
+            report['backends'][backend] = Bench(world, backend, args).run()
+        except Exception as e:
+            log(f'{backend} skipped: {e!r}')
+            report['backends'][backend] = {'error': repr(e)}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
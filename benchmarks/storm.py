@@ -0,0 +1,143 @@
+import argparse
+import json
+import logging
+import platform
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import division.entry as entry
+from benchmarks.run import BACKENDS, Bench, log, percentile, unwrap
+from benchmarks.world import World
+
+
+class Storm:
+    # logins fired from many threads at once through the real executor, as a restart brings everyone back together
+    def __init__(self, bench: Bench, logins: int, threads: int):
+        self.bench = bench
+        self.logins = logins
+        self.threads = threads
+        self.latencies: List[float] = []
+        self.service: List[float] = []
+        self._lock = threading.Lock()
+
+    def login(self, name: str):
+        # submitted the way the player_logged task is, keyed by the player and never dropped
+        submitted = time.perf_counter()
+        ip = self.bench.world.ips[name]
+
+        def run():
+            started = time.perf_counter()
+            unwrap(entry.on_player_logged)(self.bench.server, name, ip)
+            done = time.perf_counter()
+            with self._lock:
+                self.latencies.append((done - submitted) * 1000)
+                self.service.append((done - started) * 1000)
+
+        entry.executor.submit(name, run, force=True)
+
+    def fire(self, names: List[str], barrier: threading.Barrier):
+        barrier.wait()
+        for name in names:
+            self.login(name)
+
+    def run(self) -> Dict[str, Any]:
+        names = [self.bench.player() for _ in range(self.logins)]
+        barrier = threading.Barrier(self.threads + 1)
+        threads = [threading.Thread(target=self.fire, args=(names[i::self.threads], barrier))
+                   for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        self.bench.counter.ops.clear()
+        self.bench.counter.queries = 0
+        entry.executor.peak_pending = 0
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        while len(self.latencies) < self.logins:
+            time.sleep(0.001)
+        wall = time.perf_counter() - start
+        # login_latency_target bounds the work of one login, the time spent waiting for a worker is not counted
+        target = entry.config.login_latency_target * 1000
+        return {
+            'logins': self.logins,
+            'wall_s': round(wall, 3),
+            'logins_per_s': round(self.logins / wall, 1),
+            'p50_ms': round(percentile(self.latencies, 50), 4),
+            'p90_ms': round(percentile(self.latencies, 90), 4),
+            'p99_ms': round(percentile(self.latencies, 99), 4),
+            'max_ms': round(max(self.latencies), 4),
+            'mean_ms': round(statistics.fmean(self.latencies), 4),
+            'service_p50_ms': round(percentile(self.service, 50), 4),
+            'service_p99_ms': round(percentile(self.service, 99), 4),
+            'target_ms': target,
+            'over_target': sum(ms > target for ms in self.service),
+            'peak_pending': entry.executor.peak_pending,
+            'inboxes_sent': len(self.bench.server.told),
+            'ops': round(sum(self.bench.counter.ops.values()) / self.logins, 3),
+            'queries': round(self.bench.counter.queries / self.logins, 3)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times a burst of concurrent logins against synthetic worlds')
+    parser.add_argument('-b', '--backend', action='append', choices=list(BACKENDS),
+                        help='storage to run against, can be given more than once (default: direct)')
+    parser.add_argument('--players', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--groups-per-player', type=int, default=5)
+    parser.add_argument('--online', type=int, default=50, help='players reported online')
+    parser.add_argument('-n', '--logins', type=int, default=1000)
+    parser.add_argument('-t', '--threads', type=int, default=8, help='threads firing the logins')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='worker_count of the plugin')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--redis-host', default='127.0.0.1')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-db', type=int, default=15, help='flushed before the run')
+    parser.add_argument('-o', '--output', help='write the json report here instead of stdout')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show what the plugin logs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+
+    world = World(args.players, args.groups, args.messages, args.groups_per_player, seed=args.seed)
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'world': {'players': args.players, 'groups': args.groups, 'messages': args.messages,
+                      'groups_per_player': args.groups_per_player, 'online': args.online, 'seed': args.seed},
+            'threads': args.threads,
+            'workers': args.workers
+        },
+        'backends': OrderedDict()
+    }
+    for backend in args.backend or ['direct']:
+        try:
+            bench = Bench(world, backend, args, workers=args.workers)
+            bench.load()
+            try:
+                result = report['backends'][backend] = Storm(bench, args.logins, args.threads).run()
+            finally:
+                bench.unload()
+            log(f'{backend:>7} {result["logins"]} logins in {result["wall_s"]}s  p50 {result["p50_ms"]:9.3f}ms  '
+                f'p99 {result["p99_ms"]:9.3f}ms  service p99 {result["service_p99_ms"]:7.3f}ms  '
+                f'over target {result["over_target"]}  peak pending {result["peak_pending"]}')
+        except Exception as e:
+            log(f'{backend} skipped: {e!r}')
+            report['backends'][backend] = {'error': repr(e)}
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
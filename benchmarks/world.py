@@ -0,0 +1,76 @@
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from mcdreforged.api.all import *
+
+from division.constants import GROUP_OF_ALL, GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE
+from division.storage.storage import Group, Player, Msg
+
+DAY = 86400
+WORDS = ['base', 'diamond', 'nether', 'portal', 'farm', 'villager', 'redstone', 'raid', 'tonight', 'build',
+         'server', 'restart', 'backup', 'ender', 'dragon', 'shulker', 'elytra', 'trade', 'iron', 'mob']
+
+
+class World:
+    # a synthetic data set, the same seed always gives the same world
+    def __init__(self, players: int, groups: int, messages: int, groups_per_player: int = 5,
+                 all_groups: int = 5, player_msg_ratio: float = 0.1, days: int = 30, seed: int = 0):
+        rng = random.Random(seed)
+        now = time.time()
+        self.player_names = [f'player{i:05d}' for i in range(players)]
+        self.group_names = [f'group{i:03d}' for i in range(groups)]
+        self.ips = {name: f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i, name in enumerate(self.player_names)}
+
+        self.players: 'OrderedDict[str, Player]' = OrderedDict()
+        for name in self.player_names:
+            self.players[name] = Player(perm=-1, color='white', ip=self.ips[name],
+                                        latest_online_time=now - rng.random() * days * DAY)
+        self.players['server'] = Player(perm=-1, color='white', ip='127.0.0.1', latest_online_time=now)
+
+        members: Dict[str, List[str]] = {name: [] for name in self.group_names}
+        for name in self.player_names:
+            for group in rng.sample(self.group_names, min(groups_per_player, groups)):
+                members[group].append(name)
+        for group in rng.sample(self.group_names, min(all_groups, groups)):
+            members[group].append(GROUP_OF_ALL)
+        self.groups: 'OrderedDict[str, Group]' = OrderedDict()
+        for name in self.group_names:
+            self.groups[name] = Group(perm=rng.randint(0, 2), color=rng.choice(['white', 'gold', 'aqua', 'red']),
+                                      list=sorted(members[name]))
+
+        per_item: Dict[str, list] = {}
+        for _ in range(messages):
+            if rng.random() < player_msg_ratio:
+                target = rng.choice(self.player_names)
+            else:
+                target = rng.choice(self.group_names)
+            text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+            if rng.random() < 0.1:
+                text += f' http://example.com/{rng.randint(0, 9999)}'
+            per_item.setdefault(target, []).append(
+                Msg(time=now - rng.random() * days * DAY, sender=rng.choice(self.player_names), text=text))
+        for name, msgs in per_item.items():
+            msgs.sort(key=lambda msg: msg.time)  # messages are kept in the order they were sent
+            (self.groups.get(name) or self.players[name]).msg = msgs
+
+    def write_snapshots(self, folder: str):
+        # the snapshot files direct and sqlite storages load or import on their first start
+        for file_name, items in ((PLAYERS_STORAGE_FILE, self.players), (GROUPS_STORAGE_FILE, self.groups)):
+            with open(os.path.join(folder, file_name), 'w', encoding='utf8') as file:
+                json.dump(serialize(items), file, ensure_ascii=False)
+
+    def write_ip_timezones(self, folder: str, file_name: str):
+        # resolved locally, so no lookup goes out to the network
+        with open(os.path.join(folder, file_name), 'w', encoding='utf8') as file:
+            file.write('10.0.0.0,10.255.255.255,Asia/Shanghai\n127.0.0.0,127.255.255.255,UTC\n')
+
+    def add_to(self, player_storage, group_storage):
+        for name, player in self.players.items():
+            if not player_storage.contains(name):
+                player_storage.add_item(name, player)
+        for name, group in self.groups.items():
+            group_storage.add_item(name, group)
@@ -1,32 +1,37 @@
 from typing import Callable, Dict
-import time
+from threading import Lock
 
 from mcdreforged.api.all import *
 
+from division.scheduler import Scheduler, Task
+
 
 class Confirm:
-    def __init__(self):
+    TIMEOUT = 60  # confirm in 1 min
+
+    def __init__(self, scheduler: Scheduler):
+        self.scheduler = scheduler
         self.req: Dict[str, tuple] = {}
+        self._lock = Lock()
 
-    @new_thread('req_confirm')
     def req_confirm(self, source: CommandSource, callback: Callable):
         from division.entry import config, need_confirm
         if isinstance(source, PlayerCommandSource):
             key = source.player
         else:
             key = config.default_sender
-        t = time.time()
-        self.req[key] = t, callback
+        task = self.scheduler.schedule(self.TIMEOUT, lambda: self._expire(key, task))
+        with self._lock:
+            old = self.req.get(key)
+            self.req[key] = task, callback
+        if old is not None:
+            self.scheduler.cancel(old[0])
         need_confirm(source)
-        while True:
-            if key not in self.req:
-                return
-            if self.req[key][0] != t:
-                return
-            if self.req[key][0] + 60 < time.time():  # confirm in 1 min
+
+    def _expire(self, key: str, task: Task):
+        with self._lock:
+            if key in self.req and self.req[key][0] is task:
                 self.req.pop(key)
-                return
-            time.sleep(1)
 
     def apply_confirm(self, source: CommandSource):
         from division.entry import config, nothing_to_confirm
@@ -35,8 +40,11 @@ class Confirm:
             key = source.player
         else:
             key = config.default_sender
-        try:
-            t, callback = self.req.pop(key)
-            callback()
-        except Exception as e:
+        with self._lock:
+            req = self.req.pop(key, None)
+        if req is None:
             nothing_to_confirm(source)
+            return
+        task, callback = req
+        self.scheduler.cancel(task)
+        callback()
@@ -3,3 +3,10 @@ GROUPS_STORAGE_FILE = 'groups.json'
 PLAYERS_STORAGE_FILE = 'players.json'
 PREFIX = '!!div'
 GROUP_OF_ALL = 'All'
+JOURNAL_SUFFIX = '.journal'
+TZ_CACHE_FILE = 'tz_cache.json'
+STORAGE_FORMATS = {'json': '.json', 'binary': '.bin'}
+SQLITE_STORAGE_FILE = 'division.db'
+SCAN_BATCH = 256
+ARCHIVE_SUFFIX = '.jsonl.gz'
+METRICS_FILE = 'metrics.json'
@@ -1,52 +1,119 @@
 import re
-from typing import Any, Optional, List
-import requests
+from typing import Any, Optional, List, Iterator
+import heapq
+from itertools import chain, islice
+from collections import OrderedDict
 import pytz
 from datetime import datetime, timedelta
 import os
+import time
 from math import ceil
 import re
 
 from mcdreforged.api.all import *
 
 from division.confirm import Confirm
-from division.constants import CONFIG_FILE, PREFIX, GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE, GROUP_OF_ALL
+from division.executor import Executor
+from division.metrics import metrics
+from division.presence import Presence
+from division.scheduler import Scheduler
+from division.ip_timezone import IpTimezoneResolver, TimezoneCache, TimezonePrefetcher
+from division.constants import CONFIG_FILE, PREFIX, GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE, GROUP_OF_ALL, \
+    TZ_CACHE_FILE, STORAGE_FORMATS, SQLITE_STORAGE_FILE, JOURNAL_SUFFIX, SCAN_BATCH, METRICS_FILE
 from division.storage.storage import GroupStorage, Group, PlayerStorage, Player, Item, Storage, OtherStorage, \
-    build_player, build_other_storage, Msg
-from division.storage.direct import DirectGroupStorage, DirectPlayerStorage
+    build_player, build_other_storage, build_membership_storage, MembershipStorage, Msg
+from division.storage.archive import MsgArchive
+from division.storage.cache import LRUCache
+from division.storage.direct import DirectGroupStorage, DirectPlayerStorage, read_storage, storage_path
+from division.storage.index import rank
 from division.storage.redis_s import RedisGroupStorage, RedisPlayerStorage, init_redis
+from division.storage.sqlite_s import SqliteGroupStorage, SqlitePlayerStorage, SqliteStorage, init_sqlite
 
 
 
 class Config(Serializable):
     item_per_page: int = 10
+    max_message_length: int = 30000
     default_perm: int = 1
     default_color: str = 'white'
     default_sender: str = 'server'
     default_check_mode: str = 'time'
     perm_to_modify_all: int = 1
     msg_for_new_player: str = ''
+    login_msg_count: int = 10
     redis_ip: str = ''
     redis_port: int = 6379
     redis_db: int = 0
     redis_password: str = ''
+    redis_pool_size: int = 16
+    redis_socket_timeout: float = 5
+    redis_connect_timeout: float = 3
+    redis_health_check_interval: int = 30
+    redis_retries: int = 3
+    redis_retry_delay: float = 0.1
+    worker_count: int = 4
+    max_pending_tasks: int = 256
+    shutdown_timeout: float = 10
+    redis_cache_size: int = 1024
+    render_cache_size: int = 4096
+    ip_timezone_file: str = 'ip_timezone.csv'
+    tz_cache_ttl: int = 604800
+    tz_negative_ttl: int = 3600
+    tz_request_timeout: float = 3
+    tz_batch_delay: float = 1
+    storage_format: str = 'json'
+    compact_json: bool = False
+    journal: bool = True
+    journal_compact_size: int = 1048576
+    journal_compact_interval: int = 300
+    presence_flush_interval: int = 60
+    login_latency_target: float = 0.05
+    msg_max_age: int = 0
+    msg_max_count: int = 0
+    archive_folder: str = 'archive'
+    retention_sweep_interval: int = 3600
+    metrics_enabled: bool = True
+    metrics_dump_interval: int = 0
+    perm_to_view_stats: int = 3
 
 
 config: Config
 group_storage: (Storage, GroupStorage)
 player_storage: (Storage, PlayerStorage)
 other_storage: OtherStorage
+membership: MembershipStorage
 server_inst: PluginServerInterface
 HelpMessage: RTextBase
 online_player_api: Optional[Any]
 player_ip_logger: Optional[Any]
-confirm: Confirm = Confirm()
+scheduler: Scheduler = Scheduler()
+executor: Executor = Executor()
+confirm: Confirm = Confirm(scheduler)
+ip_resolver: IpTimezoneResolver = IpTimezoneResolver()
+tz_cache: TimezoneCache = TimezoneCache()
+tz_prefetcher: TimezonePrefetcher = TimezonePrefetcher(tz_cache)
+render_cache: LRUCache = LRUCache(0)
+presence: Presence = Presence()
+archive: MsgArchive = MsgArchive()
 
 
 def handle_get_storage():
-    global group_storage, player_storage, other_storage
+    global group_storage, player_storage, other_storage, membership, render_cache
+    render_cache = LRUCache(config.render_cache_size)  # versions restart with the new storages
     if config.redis_ip:
-        init_redis(host=config.redis_ip, port=config.redis_port, db=config.redis_db, password=None if config.redis_password == '' else config.redis_password)
+        init_redis(
+            host=config.redis_ip,
+            port=config.redis_port,
+            db=config.redis_db,
+            password=None if config.redis_password == '' else config.redis_password,
+            cache_size=config.redis_cache_size,
+            pool_size=config.redis_pool_size,
+            socket_timeout=config.redis_socket_timeout,
+            connect_timeout=config.redis_connect_timeout,
+            health_check_interval=config.redis_health_check_interval,
+            retries=config.redis_retries,
+            retry_delay=config.redis_retry_delay
+        )
 
         player_storage = RedisPlayerStorage()
         group_storage = RedisGroupStorage()
@@ -62,11 +129,33 @@ def handle_get_storage():
                     player_storage.add_item(player_id, build_player(ips[0]))
 
         other_storage = build_other_storage('redis')
+        membership = build_membership_storage('redis')
 
         if group_storage.first_load:
             group_storage.add_item('broadcast', Group(perm=4, color='gold'))
             handle_join_all(server_inst.get_plugin_command_source(), 'broadcast')
 
+    elif config.storage_format == 'sqlite':
+        init_sqlite(os.path.join(server_inst.get_data_folder(), SQLITE_STORAGE_FILE))
+
+        player_storage = SqlitePlayerStorage()
+        group_storage = SqliteGroupStorage()
+
+        if player_storage.first_load and not import_snapshot(player_storage, PLAYERS_STORAGE_FILE):
+            player_storage.add_item(config.default_sender, build_player('127.0.0.1'))
+            online_players = online_player_api.get_player_list()
+            for player_id in online_players:
+                if online_player_api.is_player(player_id):
+                    ips = online_player_api.get_player_ips(player_id)
+                    player_storage.add_item(player_id, build_player(ips[0] if ips else ''))
+
+        other_storage = build_other_storage('sqlite')
+        membership = build_membership_storage('sqlite')
+
+        if group_storage.first_load and not import_snapshot(group_storage, GROUPS_STORAGE_FILE):
+            group_storage.add_item('broadcast', Group(perm=4, color='gold'))
+            handle_join_all(server_inst.get_plugin_command_source(), 'broadcast')
+
     else:
         player_storage = DirectPlayerStorage()
         group_storage = DirectGroupStorage()
@@ -81,12 +170,67 @@ def handle_get_storage():
                         ips[0] = ''
                     player_storage.add_item(player_id, build_player(ips[0]))
 
-        if group_storage.load(os.path.join(server_inst.get_data_folder(), GROUPS_STORAGE_FILE)):
+        first_load = group_storage.load(os.path.join(server_inst.get_data_folder(), GROUPS_STORAGE_FILE))
+        membership = build_membership_storage('direct')
+        if first_load:
             group_storage.add_item('broadcast', Group(perm=4, color='gold'))
             handle_join_all(server_inst.get_plugin_command_source(), 'broadcast')
 
         other_storage = build_other_storage('direct')
 
+    migrate_membership()
+    presence.load(player_storage)
+    archive.open(os.path.join(server_inst.get_data_folder(), config.archive_folder))
+    if config.metrics_enabled:
+        metrics.instrument(group_storage, 'storage.group', (Storage, GroupStorage))
+        metrics.instrument(player_storage, 'storage.player', (Storage, PlayerStorage))
+        metrics.instrument(membership, 'storage.membership', (MembershipStorage,))
+        metrics.instrument(other_storage, 'storage.other', (OtherStorage,))
+
+
+def migrate_membership():
+    # players used to keep a copy of their groups, fold what is left of it into the group lists once
+    if membership.lists_migrated():
+        return
+    legacy = {}
+    names = player_storage.get_all_names()
+    for i in range(0, len(names), SCAN_BATCH):
+        chunk = names[i:i + SCAN_BATCH]
+        for name, player in zip(chunk, player_storage.get_many(chunk)):
+            if player is not None and len(player.list) > 0:
+                legacy[name] = list(player.list)
+    if len(legacy) == 0:
+        membership.mark_lists_migrated()
+        return
+    all_groups = set(other_storage.get_group_for_all())
+    listed = {}
+    repaired = 0
+    for name, groups in legacy.items():
+        for group in groups:
+            if group not in listed:
+                item = group_storage.get(group)
+                listed[group] = None if item is None else set(item.list)
+            if listed[group] is None or name in listed[group] or group in all_groups:
+                continue  # deleted group, already consistent, or copied into everyone for All
+            membership.add(group, name)
+            repaired += 1
+    player_storage.for_each(lambda name, player: player.list.clear())
+    membership.mark_lists_migrated()
+    server_inst.logger.info(f'Moved the group lists of {len(legacy)} players into the groups, '
+                            f'{repaired} memberships were missing on the group side')
+
+
+def import_snapshot(storage: SqliteStorage, file_name: str) -> bool:
+    for storage_format in STORAGE_FORMATS:
+        file_path = storage_path(os.path.join(server_inst.get_data_folder(), file_name), storage_format)
+        journal_path = file_path + JOURNAL_SUFFIX
+        if any(map(os.path.isfile, (file_path, journal_path, journal_path + '.old'))):
+            storage.import_items(read_storage(file_path, storage_format, storage.get_item_type()))
+            server_inst.logger.info(f'Imported {file_path} into {SQLITE_STORAGE_FILE}')
+            return True
+    storage.import_items(OrderedDict())  # nothing to import, marks the storage as created
+    return False
+
 
 def tr(translation_key: str, *args) -> RTextMCDRTranslation:
     return ServerInterface.get_instance().rtr(f'division.{translation_key}', *args)
@@ -102,6 +246,36 @@ def print_message(source: CommandSource, msg, tell=True, prefix: Any = '', tell_
         source.reply(msg)
 
 
+class MessageBuffer:
+    def __init__(self, source: CommandSource, tell_player: str = None):
+        self.source = source
+        self.tell_player = tell_player
+        self._lines = RTextList()
+        self._size = 0
+
+    def add(self, msg, prefix: Any = ''):
+        line = RTextList(prefix, msg)
+        size = len(line.to_json_str())
+        if self._size > 0 and self._size + size > config.max_message_length:
+            self.flush()
+        if self._size > 0:
+            self._lines.append('\n')
+        self._lines.append(line)
+        self._size += size + 1
+
+    def flush(self):
+        if self._size > 0:
+            print_message(self.source, self._lines, tell_player=self.tell_player)
+            self._lines = RTextList()
+            self._size = 0
+
+
+def print_busy(name: str, source: Optional[CommandSource] = None, *args):
+    if isinstance(source, CommandSource):  # scheduled tasks have no one to tell
+        print_message(source, tr('command.busy'))
+    server_inst.logger.warning(f'Too many pending tasks, dropped {name}')
+
+
 def print_unknown(source: CommandSource, name, item: str = 'group'):
     print_message(source, tr(f'command.unknown_{item}', RText(name, color=RColor.from_mc_value(config.default_color))))
 
@@ -115,12 +289,14 @@ def print_help_message(source: CommandSource):
     if source.is_player:
         source.reply('')
     with source.preferred_language_context():
+        buf = MessageBuffer(source)
         for line in HelpMessage.to_plain_text().splitlines():
             prefix = re.search(r'(?<=§7){}[\w ]*(?=§)'.format(PREFIX), line)
             if prefix is not None:
-                print_message(source, RText(line).set_click_event(RAction.suggest_command, prefix.group()))
+                buf.add(RText(line).set_click_event(RAction.suggest_command, prefix.group()))
             else:
-                print_message(source, line)
+                buf.add(line)
+        buf.flush()
 
 
 def req_perm(source: CommandSource, perm):
@@ -137,17 +313,38 @@ def req_is_player(source: CommandSource, player_id):
     return False
 
 
+def load_ip_timezone():
+    file_path = os.path.join(server_inst.get_data_folder(), config.ip_timezone_file)
+    count = ip_resolver.load(file_path)
+    if count > 0:
+        server_inst.logger.info(f'Loaded {count} ip ranges from {file_path}')
+    tz_cache.load(os.path.join(server_inst.get_data_folder(), TZ_CACHE_FILE))
+
+
+def prefetch_tz(ip: str):
+    if not ip_resolver.loaded:
+        tz_prefetcher.request(ip)
+
+
 def ip_to_tz(ip: str) -> str | None:
-    data = requests.get(f'http://ip-api.com/json/{ip}?fields=status,message,timezone').json()
-    if data['status'] == 'success':
-        return data['timezone']
-    else:
+    if ip_resolver.loaded:
+        return ip_resolver.resolve(ip)
+    tz = tz_cache.get(ip)
+    if tz is None:
+        tz_prefetcher.request(ip)
+    return tz
+
+
+def ip_tz(ip: str):
+    try:
+        return pytz.timezone(ip_to_tz(ip))
+    except Exception as e:
         return None
 
 
 def get_tz(source: CommandSource):
     try:
-        return pytz.timezone(ip_to_tz(player_storage.get(source.player).ip))
+        return ip_tz(player_storage.get(source.player).ip)
     except Exception as e:
         return None
 
@@ -181,19 +378,36 @@ def format_time(source: CommandSource, time_t: float, tz=None):
     return dt.strftime('%Y-%m-%d %H:%M:%S')
 
 
+def render_color(kind: str, storage: Storage, name: str) -> Optional[RColor]:
+    version = storage.get_version(name)
+    hit, value, generation = render_cache.get((kind, name))
+    if hit and value[0] == version:
+        return value[1]
+    item = storage.get(name)
+    color = None if item is None else item.get_color()  # None is cached too, for unknown senders
+    render_cache.put((kind, name), (version, color), generation)
+    return color
+
+
 def group_RText(name: str, context: str = None) -> RText:
     text = name
     try:
         text = context.format(name)
     except Exception as e:
         pass
-    if group_storage.contains(name):
-        return RText(text, color=group_storage.get(name).get_color()). \
+    color = render_color('group', group_storage, name)
+    if color is not None:
+        return RText(text, color=color). \
             h(tr('info.group')). \
             c(RAction.run_command, f'{PREFIX} info {name}')
     return RText(text, color=RColor.from_mc_value(config.default_color))
 
 
+def player_groups(name: str) -> List[str]:
+    # groups joined by All are resolved here instead of being written into every player
+    return group_storage.ordered_items(sorted(set(membership.groups_of(name)).union(other_storage.get_group_for_all())))
+
+
 def show_groups(groups):
     msg: Any = ''
     for name in groups:
@@ -211,8 +425,9 @@ def player_RText(name: str, context: str = None) -> RText:
         return RText(text, color=RColor.from_mc_value('gold')). \
             h(tr('info.list_players')). \
             c(RAction.run_command, f'{PREFIX} ids')
-    if player_storage.contains(name):
-        return RText(text, color=player_storage.get(name).get_color()). \
+    color = render_color('player', player_storage, name)
+    if color is not None:
+        return RText(text, color=color). \
             h(tr('info.player')). \
             c(RAction.run_command, f'{PREFIX} info {name}')
     return RText(text, color=RColor.from_mc_value(config.default_color))
@@ -227,27 +442,22 @@ def show_members(ids):
 
 def handle_info_update_latest_online_time(name: str):
     if name == config.default_sender or online_player_api.check_online(name):
-        player_storage.update_latest_online_time(name)
+        presence.touch(name)
 
 
 def handle_default_sender_change(new: str, old: str):
     def change_item(name, item: Item):
-        def change_sender(msg):
-            if msg.sender == old:
-                msg.set_sender(new)
-
-        item.for_each_msg(change_sender)
-
-    def change_id_in_group(name, group: Item):
-        if isinstance(group, Group):
-            if group.leave(old):
-                group.join(new)
+        item.msg = [Msg(time=msg.time, sender=new, text=msg.text) if msg.sender == old else msg for msg in item.msg]
 
     if player_storage.contains(old):
         player_storage.add_item(new, player_storage.pop_item(old))
     else:
         player_storage.add_item(new, build_player('127.0.0.1'))
-    group_storage.for_each(change_id_in_group)
+    presence.remove(old)
+    presence.touch(new)
+    for group in membership.groups_of(old):
+        membership.remove(group, old)
+        membership.add(group, new)
     group_storage.for_each(change_item)
     player_storage.for_each(change_item)
 
@@ -263,12 +473,11 @@ def log(msg):
 
 def handle_join_all(source: CommandSource, name: str):
     try:
-        if group_storage.join(name, GROUP_OF_ALL):
+        if membership.add(name, GROUP_OF_ALL):
             try:
                 other_storage.add_group_for_all(name)
             except Exception as e:
                 pass
-            player_storage.for_each(lambda n, value: value.join(name))
             print_message(source, tr('join_group.success_all', group_RText(name)))
         else:
             print_message(source, tr('join_group.exist_all', group_RText(name)))
@@ -278,16 +487,9 @@ def handle_join_all(source: CommandSource, name: str):
 
 
 def handle_leave_all(source: CommandSource, name: str):
-    group = group_storage.get(name)
     try:
-        if group_storage.leave(name, GROUP_OF_ALL):
+        if membership.remove(name, GROUP_OF_ALL):
             other_storage.remove_group_for_all(name)
-
-            def func(n, value: Player):
-                if not group.in_list(n):
-                    value.leave(name)
-
-            player_storage.for_each(func)
             print_message(source, tr('leave_group.success_all', group_RText(name)))
         else:
             print_message(source, tr('leave_group.not_exist_all', group_RText(name)))
@@ -320,39 +522,37 @@ def url_tr(text: str) -> RTextList:
     return result
 
 
-@new_thread('info')
+@executor.task('info')
 def info(source: CommandSource, name: str):
     item = group_storage.get(name)
     if item is None:
         item = player_storage.get(name)
     if item is not None:
+        buf = MessageBuffer(source)
         tz = get_tz(source)
         item_type = 'player' if isinstance(item, Player) else 'group'
-        print_message(
-            source,
+        buf.add(
             RTextList(tr(f'info.name.{item_type}') + RText(name, color=item.get_color())).
             h(tr(f'info.{item_type}')).
             c(RAction.run_command, f'{PREFIX} info {name}')
         )
         if isinstance(item, Player):
             handle_info_update_latest_online_time(name)
-            item = player_storage.get(name)
-            print_message(
-                source,
+            latest_online_time = presence.get(name) or item.latest_online_time
+            buf.add(
                 RTextList(tr('info.latest_online_time') +
-                          RText(disp_time(source, item.latest_online_time, tz), color=RColor.gray)).
-                h(format_time(source, item.latest_online_time, tz)) +
+                          RText(disp_time(source, latest_online_time, tz), color=RColor.gray)).
+                h(format_time(source, latest_online_time, tz)) +
                 '\n' +
                 tr('info.show_groups') +
                 '\n' +
-                show_groups(group_storage.ordered_items(item.list))
+                show_groups(player_groups(name))
             )
         elif isinstance(item, Group):
             members = player_storage.ordered_items(item.list)
             if GROUP_OF_ALL in item.list:
                 members.insert(0, GROUP_OF_ALL)
-            print_message(
-                source,
+            buf.add(
                 RText(tr('info.perm.header', item.perm)).
                 h(tr('info.perm.hover')).
                 c(RAction.suggest_command, f'{PREFIX} perm {name} ') +
@@ -365,40 +565,35 @@ def info(source: CommandSource, name: str):
                 is_all = item.in_list(GROUP_OF_ALL)
                 if item.in_list(source.player):
                     if is_all:
-                        print_message(
-                            source,
+                        buf.add(
                             RText(tr('info.leave_list.header')).
                             h(tr('info.leave_list.hover')).
                             c(RAction.run_command, f'{PREFIX} leave {name}')
                         )
                     else:
-                        print_message(
-                            source,
+                        buf.add(
                             RText(tr('info.leave.header')).
                             h(tr('info.leave.hover')).
                             c(RAction.run_command, f'{PREFIX} leave {name}')
                         )
                 else:
                     if is_all:
-                        print_message(
-                            source,
+                        buf.add(
                             RText(tr('info.join_list.header')).
                             h(tr('info.join_list.hover')).
                             c(RAction.run_command, f'{PREFIX} join {name}')
                         )
                     else:
-                        print_message(
-                            source,
+                        buf.add(
                             RText(tr('info.join.header')).
                             h(tr('info.join.hover')).
                             c(RAction.run_command, f'{PREFIX} join {name}')
                         )
-        print_message(source, tr('msg.text'))
+        buf.add(tr('msg.text'))
         count = 0
         for msg in item.msg:
             count += 1
-            print_message(
-                source,
+            buf.add(
                 f'[{str(count)}] ' +
 
                 RText('[×] ', color=RColor.red).
@@ -414,17 +609,17 @@ def info(source: CommandSource, name: str):
                 h(tr('msg.edit')).
                 c(RAction.suggest_command, f'{PREFIX} edit {name} {count} {reverse_interpreter(msg.text) if source.is_player else msg.text}')
             )
-        print_message(
-            source,
+        buf.add(
             RText(tr('info.send.header')).
             h(tr('info.send.hover')).
             c(RAction.suggest_command, f'{PREFIX} send {name} ')
         )
+        buf.flush()
     else:
         print_unknown(source, name)
 
 
-@new_thread('make_group')
+@executor.task('make_group')
 def make_group(source: CommandSource, name, perm: int, color: str):
     try:
         disp_name = RText(name, color=RColor.from_mc_value(color))
@@ -472,7 +667,7 @@ def make_group(source: CommandSource, name, perm: int, color: str):
         )
 
 
-@new_thread('del_group')
+@executor.task('del_group')
 def del_group(source: CommandSource, name):
     if group_storage.contains(name):
         if req_perm(source, group_storage.get(name).perm):
@@ -480,14 +675,11 @@ def del_group(source: CommandSource, name):
 
         def confirm_del_group():
             try:
+                membership.remove_group(name)
                 item = group_storage.pop_item(name)
-                for player_id in item.list:
-                    if player_id == GROUP_OF_ALL:
-                        handle_leave_all(source, name)
-                    else:
-                        player_storage.leave(player_id, name)
-
-
+                if item.in_list(GROUP_OF_ALL):
+                    other_storage.remove_group_for_all(name)
+                archive.remove('group', name)
             except Exception as e:
                 print_message(
                     source,
@@ -507,7 +699,7 @@ def del_group(source: CommandSource, name):
         print_unknown(source, name)
 
 
-@new_thread('perm_group')
+@executor.task('perm_group')
 def perm_group(source: CommandSource, name, level: int):
     if group_storage.contains(name):
         if req_perm(source, level):
@@ -535,7 +727,7 @@ def perm_group(source: CommandSource, name, level: int):
         print_unknown(source, name)
 
 
-@new_thread('color_item')
+@executor.task('color_item')
 def color_item(source: CommandSource, name, color: str):
     item = group_storage.get(name)
     if item is None:
@@ -590,7 +782,7 @@ def color_item(source: CommandSource, name, color: str):
         print_unknown(source, name, 'group_or_player')
 
 
-@new_thread('join_group')
+@executor.task('join_group')
 def join_group(source: CommandSource, name, player_id=None):
     if group_storage.contains(name):
         if player_id is None:
@@ -617,17 +809,12 @@ def join_group(source: CommandSource, name, player_id=None):
             return
 
         try:
-            is_all = group.in_list(GROUP_OF_ALL)
-            group_join = group_storage.join(name, player_id)
-            player_join = player_storage.join(player_id, name)
-            if group_join and player_join and not is_all:
-                print_message(source, tr('join_group.success', player_RText(player_id), group_RText(name)))
-            elif group_join and not player_join and is_all:
-                print_message(source, tr('join_group.is_all', player_RText(player_id), group_RText(name)))
-            elif not group_join and not player_join:
+            if not membership.add(name, player_id):
                 print_message(source, tr('join_group.exist', player_RText(player_id), group_RText(name)))
+            elif group.in_list(GROUP_OF_ALL):
+                print_message(source, tr('join_group.is_all', player_RText(player_id), group_RText(name)))
             else:
-                print_message(source, tr('join_group.warn', player_RText(player_id), group_RText(name)))
+                print_message(source, tr('join_group.success', player_RText(player_id), group_RText(name)))
         except Exception as e:
             print_message(source, tr('join_group.fail', player_RText(player_id), group_RText(name), e))
             server_inst.logger.exception('Failed to make {} join group {}'.format(player_id, name))
@@ -635,7 +822,7 @@ def join_group(source: CommandSource, name, player_id=None):
         print_unknown(source, name)
 
 
-@new_thread('leave_group')
+@executor.task('leave_group')
 def leave_group(source: CommandSource, name, player_id=None):
     if group_storage.contains(name):
         if player_id is None:
@@ -654,29 +841,21 @@ def leave_group(source: CommandSource, name, player_id=None):
             return
 
         group = group_storage.get(name)
-        player = player_storage.get(player_id)
 
         if req_perm(source, group.perm):
             return
 
         try:
             is_all = group.in_list(GROUP_OF_ALL)
-            group_leave = group_storage.leave(name, player_id)
-            player_in = player.in_list(name)
-            if group_leave and player_in and not is_all:
-                player_storage.leave(player_id, name)
-                print_message(source, tr('leave_group.success', player_RText(player_id), group_RText(name)))
-            elif group_leave and player_in and is_all:
-                print_message(source, tr('leave_group.is_all_listed', player_RText(player_id), group_RText(name)))
-            elif not group_leave and player_in and is_all:
+            if membership.remove(name, player_id):
+                if is_all:
+                    print_message(source, tr('leave_group.is_all_listed', player_RText(player_id), group_RText(name)))
+                else:
+                    print_message(source, tr('leave_group.success', player_RText(player_id), group_RText(name)))
+            elif is_all:
                 print_message(source, tr('leave_group.is_all_not_listed', player_RText(player_id), group_RText(name)))
-            elif not group_leave and not player_in and not is_all:
-                print_message(source, tr('leave_group.not_exist', player_RText(player_id), group_RText(name)))
-            elif not group_leave and not player_in and is_all:
-                print_message(source, tr('leave_group.warn_all', player_RText(player_id), group_RText(name)))
             else:
-                player_storage.leave(player_id, name)
-                print_message(source, tr('leave_group.warn', player_RText(player_id), group_RText(name)))
+                print_message(source, tr('leave_group.not_exist', player_RText(player_id), group_RText(name)))
         except Exception as e:
             print_message(source, tr('leave_group.fail', player_RText(player_id), group_RText(name), e))
             server_inst.logger.exception('Failed to make {} leave group {}'.format(player_id, name))
@@ -684,7 +863,7 @@ def leave_group(source: CommandSource, name, player_id=None):
         print_unknown(source, name)
 
 
-@new_thread('send_msg')
+@executor.task('send_msg')
 def send_msg(source: CommandSource, name, msg: str):
     item = group_storage.get(name)
     if item is None:
@@ -722,7 +901,7 @@ def send_msg(source: CommandSource, name, msg: str):
         print_unknown(source, name, 'group_or_player')
 
 
-@new_thread('edit_msg')
+@executor.task('edit_msg')
 def edit_msg(source: CommandSource, name, line: int, msg: str):
     item = group_storage.get(name)
     if item is None:
@@ -762,7 +941,7 @@ def edit_msg(source: CommandSource, name, line: int, msg: str):
         print_unknown(source, name, 'group_or_player')
 
 
-@new_thread('del_msg')
+@executor.task('del_msg')
 def del_msg(source: CommandSource, name, line: int):
     item = group_storage.get(name)
     if item is None:
@@ -829,13 +1008,14 @@ def nothing_to_confirm(source: CommandSource):
     print_message(source, tr('confirm.nothing_to_confirm'))
 
 
-@new_thread('place_group')
+@executor.task('place_group')
 def place_group(source: CommandSource, name, pos):
     if group_storage.contains(name):
         if req_perm(source, group_storage.get(name).perm):
             return
         try:
-            group_storage.place_item(name, pos - 1)
+            if group_storage.rank(name) != pos - 1:
+                group_storage.place_item(name, pos - 1)
         except Exception as e:
             print_message(
                 source,
@@ -855,33 +1035,83 @@ def place_group(source: CommandSource, name, pos):
         print_unknown(source, name)
 
 
-@new_thread('list_items')
+def page_nav(command: str, page: int, page_count: int) -> RTextList:
+    has_prev = page > 1
+    has_next = page < page_count
+    color = {False: RColor.dark_gray, True: RColor.gray}
+
+    prev_page = RText('<-', color=color[has_prev])
+    if has_prev:
+        prev_page.h(tr('list_item.page_prev.Y')). \
+            c(RAction.run_command, f'{command}{page - 1}')
+    else:
+        prev_page.h(tr('list_item.page_prev.N'))
+
+    next_page = RText('->', color=color[has_next])
+    if has_next:
+        next_page.h(tr('list_item.page_next.Y')). \
+            c(RAction.run_command, f'{command}{page + 1}')
+    else:
+        next_page.h(tr('list_item.page_next.N'))
+
+    return RTextList(
+        prev_page,
+        RText(f' §a{page}§r/§a{page_count} ').
+        h(tr('list_item.change_page')).
+        c(RAction.suggest_command, command),
+        next_page
+    )
+
+
+@executor.task('list_items')
 def list_items(source: CommandSource, *, mode: str = 'search', keyword: Optional[str] = None, page: Optional[int] = None):
+    buf = MessageBuffer(source)
     tz = get_tz(source)
-    matched_items: List[tuple] = []
     online_players = online_player_api.get_player_list()
     if mode == 'search':
-        for name in player_storage.get_all_names():
-            if name.find(keyword) != -1:
-                if name in online_players:
-                    player_storage.update_latest_online_time(name)
-                player = player_storage.get(name)
-                matched_items.append((name, player.color, player.latest_online_time))
-        for name in group_storage.get_all_names():
-            if name.find(keyword) != -1:
-                matched_items.append((name, group_storage.get(name).color))
+        matched_names = [(name, player_storage) for name in player_storage.search(keyword)] + \
+                        [(name, group_storage) for name in group_storage.search(keyword)]
+        matched_names.sort(key=lambda elem: rank(keyword, elem[0]))
+        matched_count = len(matched_names)
+
+        def get_items(left: int, right: Optional[int]) -> List[tuple]:
+            items = []
+            for n, s in matched_names[left:right]:
+                value = s.get(n)
+                if isinstance(value, Player):
+                    items.append((n, value.color, presence.get(n) or value.latest_online_time))
+                elif value is not None:
+                    items.append((n, value.color))
+            return items
+    elif mode == 'list':
+        matched_count = group_storage.count()
+
+        def get_items(left: int, right: Optional[int]) -> List[tuple]:
+            items = []
+            for n in group_storage.get_range(left, right):
+                value = group_storage.get(n)
+                if value is not None:
+                    items.append((n, value.color))
+            return items
     else:
-        storage: Storage
-        if mode == 'list':
-            group_storage.for_each(lambda n, value: matched_items.append((n, value.color)))
-        elif mode == 'ids':
-            for player_id in online_players:
-                if player_storage.contains(player_id):
-                    player_storage.update_latest_online_time(player_id)
-                player_storage.update_latest_online_time(config.default_sender)
-            player_storage.for_each(lambda n, value: matched_items.append((n, value.color, value.latest_online_time)))
+        for player_id in online_players:
+            if player_storage.contains(player_id):
+                presence.touch(player_id)
+        if player_storage.contains(config.default_sender):
+            presence.touch(config.default_sender)
+        if presence.count() != player_storage.count():  # players added or removed by another server
+            presence.flush()
+            presence.load(player_storage)
+        matched_count = presence.count()
+
+        def get_items(left: int, right: Optional[int]) -> List[tuple]:
+            items = []
+            for n in presence.get_range(left, right):
+                value = player_storage.get(n)
+                if value is not None:
+                    items.append((n, value.color, presence.get(n)))
+            return items
 
-    matched_count = len(matched_items)
     page_count = ceil(matched_count / config.item_per_page)
 
     def line(name: str, color: str, time: float = None):
@@ -898,127 +1128,241 @@ def list_items(source: CommandSource, *, mode: str = 'search', keyword: Optional
         return r
     
     if page is None:
-        for args in matched_items:
-            print_message(source, line(*args), prefix=RText('- ', color=RColor.gray))
+        for args in get_items(0, None):
+            buf.add(line(*args), prefix=RText('- ', color=RColor.gray))
     else:
         if page > page_count:
             page = page_count
-        left, right = (page - 1) * config.item_per_page, page * config.item_per_page
-        for i in range(left, right):
-            if 0 <= i < matched_count:
-                print_message(source, line(*matched_items[i]), prefix=RText('- ', color=RColor.gray))
-
-        has_prev = page != 1
-        has_next = page != page_count
-        color = {False: RColor.dark_gray, True: RColor.gray}
+        left, right = max(0, (page - 1) * config.item_per_page), max(0, page * config.item_per_page)
+        for args in get_items(left, right):
+            buf.add(line(*args), prefix=RText('- ', color=RColor.gray))
+
         if keyword is None:
             keyword = ''
         else:
             keyword += ' '
+        buf.add(page_nav(f'{PREFIX} {mode} {keyword}', page, page_count))
 
-        prev_page = RText('<-', color=color[has_prev])
-        if has_prev:
-            prev_page.h(tr('list_item.page_prev.Y')). \
-                c(RAction.run_command, f'{PREFIX} {mode} {keyword}{page - 1}')
-        else:
-            prev_page.h(tr('list_item.page_prev.N'))
+    buf.add(tr(f'list_item.count.{mode}', matched_count))
+    buf.flush()
 
-        next_page = RText('->', color=color[has_next])
-        if has_next:
-            next_page.h(tr('list_item.page_next.Y')). \
-                c(RAction.run_command, f'{PREFIX} {mode} {keyword}{page + 1}')
-        else:
-            next_page.h(tr('list_item.page_next.N'))
 
-        source.reply(RTextList(
-            prev_page,
-            RText(f' §a{page}§r/§a{page_count} ').
-            h(tr('list_item.change_page')).
-            c(RAction.suggest_command, f'{PREFIX} {mode} {keyword}'),
-            next_page
-        ))
+def iter_item_msgs(name: str, msgs: List[Msg], start: int, reverse: bool = False) -> Iterator[tuple]:
+    # msgs begins at line start + 1 of the item, so the numbers still work with edit and del
+    idxs = range(len(msgs) - 1, -1, -1) if reverse else range(len(msgs))
+    for idx in idxs:
+        yield name, msgs[idx], start + idx + 1
 
-    print_message(source, tr(f'list_item.count.{mode}', matched_count))
 
+def iter_msgs(sources: List[tuple], mode: str, reverse: bool = False) -> Iterator[tuple]:
+    streams = [iter_item_msgs(name, msgs, start, reverse) for name, msgs, start in sources]
+    if mode == 'time':
+        return heapq.merge(*streams, key=lambda elem: elem[1].time, reverse=reverse)
+    return chain(*streams)
 
-@new_thread('check_msg')
-def check_msg(source: CommandSource, mode: str = None, tell_player: str = None):
-    if mode is None:
-        mode = config.default_check_mode
-    msgs: List[(str, Msg, int)] = []
 
-    if tell_player is not None:
-        player_id = tell_player
-    elif isinstance(source, PlayerCommandSource):
-        player_id = source.player
+def read_inbox(player_id: str, player: Player, after: float = None) -> List[tuple]:
+    names = player_groups(player_id)
+    sources = []
+    if after is None:
+        for name, group in zip(names, group_storage.get_many(names)):
+            if group is not None:
+                sources.append((name, group.msg, 0))
+        sources.append((player_id, player.msg, 0))
     else:
-        player_id = config.default_sender
+        for name, part in zip(names, group_storage.get_msgs_after(names, after)):
+            if part is not None:
+                sources.append((name, part[1], part[0]))
+        start = player.msgs_after(after)
+        sources.append((player_id, player.msg[start:], start))
+    return sources
+
+
+def read_unread(player_id: str, player: Player) -> List[tuple]:
+    return read_inbox(player_id, player, presence.last_checked(player_id, player.last_checked))
+
+
+def mark_checked(player_id: str, sources: List[tuple]):
+    latest = max((msgs[-1].time for name, msgs, start in sources if len(msgs) > 0), default=None)
+    if latest is not None:
+        presence.check(player_id, latest)
+
+
+def send_inbox(source: CommandSource, player_id: str, sources: List[tuple], mode: str, tz,
+               tell_player: str = None, page: int = None, limit: int = None, unread: bool = False):
+    msg_count = sum(len(msgs) for name, msgs, start in sources)
+
+    skipped = 0
+    if page is not None:
+        page_count = ceil(msg_count / config.item_per_page)
+        page = min(page, page_count)
+        left = max(0, (page - 1) * config.item_per_page)
+        msgs = islice(iter_msgs(sources, mode), left, left + config.item_per_page)
+    elif limit is not None and msg_count > limit:
+        skipped = msg_count - limit
+        msgs = list(islice(iter_msgs(sources, 'time', reverse=True), limit))
+        order = {name: idx for idx, (name, m, start) in enumerate(sources)}
+        msgs.sort(key=lambda elem: elem[1].time if mode == 'time' else (order[elem[0]], elem[2]))
+    else:
+        msgs = iter_msgs(sources, mode)
 
-    if player_storage.contains(player_id):
-        tz = get_tz(source)
-        groups = group_storage.ordered_items(player_storage.get(player_id).list)
-        for name in groups:
-            group = group_storage.get(name)
-            count = 0
-            for msg in group.msg:
-                count += 1
-                msgs.append((name, msg, count))
-        player = player_storage.get(player_id)
-        count = 0
-        for msg in player.msg:
-            count += 1
-            msgs.append((player_id, msg, count))
+    buf = MessageBuffer(source, tell_player)
+    buf.add(tr('msg.text'))
 
-        if mode == 'time':
-            msgs.sort(key=lambda elem: elem[1].time)
+    if skipped > 0:
+        buf.add(
+            tr('msg.more', skipped).
+            h(tr('msg.more_hover')).
+            c(RAction.run_command, f'{PREFIX} check {mode} 1')
+        )
 
-        print_message(source, tr('msg.text'), tell_player=tell_player)
+    for name, msg, count in msgs:
+        if name == player_id:
+            disp_name = player_RText(player_id, '[{}] ')
+        else:
+            disp_name = group_RText(name, '[{}] ')
 
-        for name, msg, count in msgs:
-            if name == player_id:
-                disp_name = player_RText(player_id, '[{}] ')
-            else:
-                disp_name = group_RText(name, '[{}] ')
+        buf.add(
+            RText('[×] ', color=RColor.red).
+            h(tr('msg.delete')).
+            c(RAction.run_command, f'{PREFIX} del {name} {count}') +
 
-            print_message(
-                source,
+            disp_name +
 
-                RText('[×] ', color=RColor.red).
-                h(tr('msg.delete')).
-                c(RAction.run_command, f'{PREFIX} del {name} {count}') +
+            RText(f'[{disp_time(source, msg.time, tz)}] ', color=RColor.gray).
+            h(format_time(source, msg.time, tz)) +
 
-                disp_name +
+            player_RText(msg.sender, '<{}> ') +
 
-                RText(f'[{disp_time(source, msg.time, tz)}] ', color=RColor.gray).
-                h(format_time(source, msg.time, tz)) +
+            url_tr(msg.text).
+            h(tr('msg.edit')).
+            c(RAction.suggest_command, f'{PREFIX} edit {name} {count} {msg.text}')
+        )
 
-                player_RText(msg.sender, '<{}> ') +
+    if page is not None:
+        buf.add(page_nav(f'{PREFIX} check {mode} ', page, page_count))
+    if unread:
+        buf.add(
+            tr('msg.new_count', msg_count).
+            h(tr('msg.more_hover')).
+            c(RAction.run_command, f'{PREFIX} check all')
+        )
+    else:
+        buf.add(tr('msg.count', msg_count))
+    buf.flush()
 
-                url_tr(msg.text).
-                h(tr('msg.edit')).
-                c(RAction.suggest_command, f'{PREFIX} edit {name} {count} {msg.text}'),
 
-                tell_player=tell_player
-            )
+@executor.task('check_msg')
+def check_msg(source: CommandSource, mode: str = None, page: int = None, unread: bool = False):
+    if mode is None:
+        mode = config.default_check_mode
+    player_id = source.player if isinstance(source, PlayerCommandSource) else config.default_sender
+    player = player_storage.get(player_id)
+    if player is None:
+        print_unknown(source, player_id, 'player')
+        return
+    if unread:
+        sources = read_unread(player_id, player)
+        send_inbox(source, player_id, sources, mode, get_tz(source), unread=True)
+        mark_checked(player_id, sources)
+    else:
+        send_inbox(source, player_id, read_inbox(player_id, player), mode, get_tz(source), page=page)
 
-        print_message(source, tr('msg.count', len(msgs)), tell_player=tell_player)
 
-    else:
-        print_unknown(source, player_id, 'player')
+def expired_count(item: Item, cutoff: Optional[float]) -> int:
+    count = 0 if cutoff is None else item.msgs_after(cutoff)
+    if config.msg_max_count > 0:
+        count = max(count, len(item.msg) - config.msg_max_count)
+    return count
 
 
-@new_thread('player_logged')
-def on_player_logged(server: PluginServerInterface, player_name: str, player_ip: str):
-    if not player_storage.contains(player_name):
-        player_storage.add_item(player_name, build_player(player_ip))
-    player_storage.update_latest_online_time(player_name)
-    check_msg(server.get_plugin_command_source(), tell_player=player_name)
+@executor.task('sweep_msgs')
+def sweep_msgs():
+    if config.msg_max_age <= 0 and config.msg_max_count <= 0:
+        return
+    cutoff = time.time() - config.msg_max_age if config.msg_max_age > 0 else None
+    archived = 0
+    for kind, storage in (('group', group_storage), ('player', player_storage)):
+        names = storage.get_all_names()
+        for i in range(0, len(names), SCAN_BATCH):
+            chunk = names[i:i + SCAN_BATCH]
+            for name, item in zip(chunk, storage.get_many(chunk)):
+                count = 0 if item is None else expired_count(item, cutoff)
+                if count == 0:
+                    continue
+                msgs = item.msg[:count]
+                # archived before the trim, a sweep that stopped in between skips what is already in the archive
+                start = min(item.msgs_after(archive.archived_until(kind, name)), count)
+                if start < count:
+                    archive.append(kind, name, msgs[start:])
+                if storage.trim_msgs(name, count, msgs[-1].time):
+                    archived += count
+    if archived > 0:
+        server_inst.logger.info(f'Archived {archived} expired messages')
+
+
+@executor.task('history')
+def history(source: CommandSource, name: str, page: int = 1):
+    if group_storage.contains(name):
+        kind, disp_name = 'group', group_RText(name)
+    elif player_storage.contains(name):
+        kind, disp_name = 'player', player_RText(name)
+    else:
+        print_unknown(source, name)
+        return
+    tz = get_tz(source)
+    left = (max(page, 1) - 1) * config.item_per_page
+    msgs = []
+    total = 0
+    for msg in archive.iter(kind, name):  # streamed, only the shown page is kept
+        if left <= total < left + config.item_per_page:
+            msgs.append(msg)
+        total += 1
+
+    buf = MessageBuffer(source)
+    buf.add(tr('history.header', disp_name, total))
+    for idx, msg in enumerate(msgs, left + 1):
+        buf.add(
+            f'[{idx}] ' +
+
+            RText(f'[{disp_time(source, msg.time, tz)}] ', color=RColor.gray).
+            h(format_time(source, msg.time, tz)) +
+
+            player_RText(msg.sender, '<{}> ') +
+
+            url_tr(msg.text)
+        )
+    if total > config.item_per_page:
+        buf.add(page_nav(f'{PREFIX} history {name} ', page, ceil(total / config.item_per_page)))
+    buf.flush()
 
 
-@new_thread('player_left')
+@executor.task('player_logged', droppable=False)
+def on_player_logged(server: PluginServerInterface, player_name: str, player_ip: str):
+    # one read of the player, one batched read of the new messages of its groups and one tell,
+    # the online time and the last checked time are flushed later
+    start = time.perf_counter()
+    prefetch_tz(player_ip)
+    player = player_storage.get(player_name)
+    if player is None:
+        player = build_player(player_ip)
+        player_storage.add_item(player_name, player)
+    presence.touch(player_name)
+    sources = read_unread(player_name, player)
+    if any(len(source[1]) > 0 for source in sources):
+        send_inbox(server.get_plugin_command_source(), player_name, sources, config.default_check_mode,
+                   ip_tz(player_ip), tell_player=player_name, limit=config.login_msg_count, unread=True)
+        mark_checked(player_name, sources)
+    elapsed = time.perf_counter() - start
+    metrics.observe('login', elapsed)
+    if elapsed > config.login_latency_target:
+        server.logger.warning(f'Login of {player_name} took {elapsed * 1000:.1f}ms')
+
+
+@executor.task('player_left', droppable=False)
 def on_player_left(server: PluginServerInterface, player):
     if player_storage.contains(player):
-        player_storage.update_latest_online_time(player)
+        presence.touch(player)
 
 
 def register_command(server: PluginServerInterface):
@@ -1040,6 +1384,13 @@ def register_command(server: PluginServerInterface):
         ).
         then(Literal('search').then(search_group)).
         then(search_group).  # for lazy_man
+        then(
+            Literal('history').then(
+                QuotableText('name').
+                runs(lambda src, ctx: history(src, ctx['name'])).
+                then(Integer('page').runs(lambda src, ctx: history(src, ctx['name'], ctx['page'])))
+            )
+        ).
         then(
             Literal('info').then(
                 QuotableText('name').runs(lambda src, ctx: info(src, ctx['name']))
@@ -1140,16 +1491,30 @@ def register_command(server: PluginServerInterface):
         ).
         then(
             Literal('check').
-            runs(lambda src: check_msg(src)).
+            runs(lambda src: check_msg(src, unread=True)).
+            then(Integer('page').runs(lambda src, ctx: check_msg(src, page=ctx['page']))).
+            then(
+                Literal('all').
+                runs(lambda src: check_msg(src)).
+                then(Integer('page').runs(lambda src, ctx: check_msg(src, page=ctx['page'])))
+            ).
             then(
                 Literal('time').
-                runs(lambda src: check_msg(src, mode='time'))
+                runs(lambda src: check_msg(src, mode='time')).
+                then(Integer('page').runs(lambda src, ctx: check_msg(src, mode='time', page=ctx['page'])))
             ).
             then(
                 Literal('group').
-                runs(lambda src: check_msg(src, mode='group'))
+                runs(lambda src: check_msg(src, mode='group')).
+                then(Integer('page').runs(lambda src, ctx: check_msg(src, mode='group', page=ctx['page'])))
             )
         ).
+        then(
+            Literal('stats').
+            runs(lambda src: stats(src)).
+            then(Integer('page').runs(lambda src, ctx: stats(src, ctx['page']))).
+            then(Literal('reset').runs(lambda src: reset_stats(src)))
+        ).
         then(
             Literal('confirm').
             runs(lambda src: confirm.apply_confirm(src))
@@ -1157,6 +1522,52 @@ def register_command(server: PluginServerInterface):
     )
 
 
+def stats(source: CommandSource, page: int = 1):
+    if req_perm(source, config.perm_to_view_stats):
+        return
+    # slowest first by the time spent in them, so whatever stalls the server is on the first page
+    timers = sorted(metrics.timers().items(), key=lambda elem: elem[1].total, reverse=True)
+    left = (max(page, 1) - 1) * config.item_per_page
+    buf = MessageBuffer(source)
+    buf.add(tr('stats.header', datetime.fromtimestamp(metrics.since).strftime('%Y-%m-%d %H:%M:%S')))
+    buf.add(tr('stats.executor', executor.pending, executor.running, executor.peak_pending, executor.rejected))
+    for name, hist in timers[left:left + config.item_per_page]:
+        buf.add(
+            RText(name, color=RColor.aqua) +
+            tr('stats.timer', hist.count, f'{hist.percentile(50):.2f}', f'{hist.percentile(99):.2f}',
+               f'{hist.max:.2f}', f'{hist.total:.0f}')
+        )
+    if len(timers) > config.item_per_page:
+        buf.add(page_nav(f'{PREFIX} stats ', page, ceil(len(timers) / config.item_per_page)))
+    counters = metrics.snapshot()['counters']
+    if len(counters) > 0:
+        buf.add(tr('stats.counters', ', '.join(f'{name}={value}' for name, value in counters.items())))
+    buf.flush()
+
+
+def reset_stats(source: CommandSource):
+    if req_perm(source, config.perm_to_view_stats):
+        return
+    metrics.reset()
+    print_message(source, tr('stats.reset'))
+
+
+def dump_metrics():
+    try:
+        metrics.dump(os.path.join(server_inst.get_data_folder(), METRICS_FILE))
+    except Exception as e:
+        server_inst.logger.warning(f'Failed to dump metrics: {e}')
+
+
+def check_intervals():
+    # a scheduled task with no interval would run again at once, forever
+    default = Config.get_default()
+    for key in ('presence_flush_interval', 'retention_sweep_interval'):
+        if getattr(config, key) <= 0:
+            server_inst.logger.warning(f'{key} must be positive, using the default {getattr(default, key)}s')
+            setattr(config, key, getattr(default, key))
+
+
 def on_load(server: PluginServerInterface, old):
     global config, HelpMessage, server_inst, online_player_api, player_ip_logger
     server_inst = server
@@ -1165,9 +1576,31 @@ def on_load(server: PluginServerInterface, old):
     player_ip_logger = server.get_plugin_instance('player_ip_logger')
     HelpMessage = tr('help_message', PREFIX, meta.name, meta.version)
     config = server.load_config_simple(CONFIG_FILE, target_class=Config)
+    check_intervals()
+    metrics.enabled = config.metrics_enabled
+    executor.on_reject = print_busy
+    executor.start(config.worker_count, config.max_pending_tasks)
     handle_get_storage()
+    scheduler.every(config.presence_flush_interval, presence.flush)
+    scheduler.every(config.retention_sweep_interval, sweep_msgs)
+    if config.metrics_enabled and config.metrics_dump_interval > 0:
+        scheduler.every(config.metrics_dump_interval, dump_metrics)
+    load_ip_timezone()
     if old is not None:
         handle_config_change(config, old.config)
     register_command(server)
     server.register_help_message(PREFIX, command_run(tr('register.summary_help'), tr('register.show_help'), PREFIX))
     server.register_event_listener('player_ip_logger.player_login', on_player_logged)
+
+
+def on_unload(server: PluginServerInterface):
+    scheduler.stop()
+    executor.stop()
+    if not executor.join(config.shutdown_timeout):
+        server.logger.warning(f'{executor.running + executor.pending} tasks were still running after '
+                              f'{config.shutdown_timeout}s, closing the storages anyway')
+    presence.flush()
+    player_storage.close()
+    group_storage.close()
+    if config.metrics_enabled and config.metrics_dump_interval > 0:
+        dump_metrics()
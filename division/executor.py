@@ -0,0 +1,113 @@
+import functools
+import time
+from collections import deque
+from threading import Condition, Thread
+from typing import Callable, Deque, Dict, Hashable, List, Optional
+
+from mcdreforged.api.all import *
+
+from division.metrics import metrics
+
+
+class Executor:
+    def __init__(self):
+        self.max_pending = 256
+        self.pending = 0
+        self.running = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.on_reject: Optional[Callable] = None
+        self._cond = Condition()
+        self._ready: Deque[Hashable] = deque()
+        self._queues: Dict[Hashable, Deque[tuple]] = {}
+        self._workers = 0
+        self._threads: List[Thread] = []
+        self._stopping = False
+
+    def start(self, workers: int, max_pending: int):
+        with self._cond:
+            self.max_pending = max_pending
+            self._stopping = False
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            while self._workers < workers:
+                self._workers += 1
+                self._threads.append(self._work())
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True  # workers exit once the queued tasks are done
+            self._cond.notify_all()
+
+    def join(self, timeout: float) -> bool:
+        # waits for the workers to exit after stop(), returns whether all of them did in time
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def submit(self, key: Optional[Hashable], func: Callable, *args, force: bool = False, **kwargs) -> bool:
+        with self._cond:
+            if not force and self.pending >= self.max_pending:
+                self.rejected += 1
+                metrics.add('executor.rejected')
+                return False
+            if key is None:
+                key = object()  # no ordering needed
+            queue = self._queues.get(key)
+            if queue is None:
+                self._queues[key] = deque([(func, args, kwargs, time.perf_counter())])
+                self._ready.append(key)
+                self._cond.notify()
+            else:
+                queue.append((func, args, kwargs, time.perf_counter()))
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        return True
+
+    def queue_depths(self) -> Dict[Hashable, int]:
+        with self._cond:
+            return {key: len(queue) for key, queue in self._queues.items() if isinstance(key, str)}
+
+    def task(self, name: str, keyed: bool = True, droppable: bool = True):
+        def wrapper(func: Callable):
+            @functools.wraps(func)
+            def wrap(*args, **kwargs):
+                key = args[1] if keyed and len(args) > 1 else None
+                if not self.submit(key, func, *args, force=not droppable, **kwargs) and self.on_reject is not None:
+                    self.on_reject(name, *args)
+            return wrap
+        return wrapper
+
+    @new_thread('division_worker')
+    def _work(self):
+        while True:
+            with self._cond:
+                while len(self._ready) == 0 and not self._stopping:
+                    self._cond.wait()
+                if len(self._ready) == 0:
+                    self._workers -= 1
+                    return
+                key = self._ready.popleft()
+                func, args, kwargs, submitted = self._queues[key][0]
+                self.pending -= 1
+                self.running += 1
+            start = time.perf_counter()
+            metrics.observe('executor.wait', start - submitted)
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                from division.entry import server_inst
+                server_inst.logger.exception(f'Error in task {func.__name__}')
+                metrics.add(f'task.{func.__name__}.errors')
+            metrics.observe(f'task.{func.__name__}', time.perf_counter() - start)
+            with self._cond:
+                self.running -= 1
+                self.completed += 1
+                queue = self._queues[key]
+                queue.popleft()
+                if len(queue) > 0:
+                    self._ready.append(key)
+                    self._cond.notify()
+                else:
+                    del self._queues[key]
@@ -0,0 +1,172 @@
+import bisect
+import csv
+import ipaddress
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+import requests
+
+from mcdreforged.api.all import *
+
+from division.metrics import metrics
+
+
+IPV4_MAPPED_OFFSET = 0xffff00000000
+
+
+def ip_to_int(ip: str) -> int:
+    addr = ipaddress.ip_address(ip.strip())
+    if isinstance(addr, ipaddress.IPv4Address):
+        return int(addr) + IPV4_MAPPED_OFFSET
+    return int(addr)
+
+
+def parse_range(row: List[str]) -> Tuple[int, int, str]:
+    if len(row) == 2:  # <network>,<timezone>
+        network = ipaddress.ip_network(row[0].strip(), strict=False)
+        return ip_to_int(str(network[0])), ip_to_int(str(network[-1])), row[1].strip()
+    else:  # <start_ip>,<end_ip>,<timezone>
+        return ip_to_int(row[0]), ip_to_int(row[1]), row[2].strip()
+
+
+class IpTimezoneResolver:
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+        self._tzs: List[str] = []
+
+    @property
+    def loaded(self) -> bool:
+        return len(self._starts) > 0
+
+    def load(self, file_path: str) -> int:
+        ranges: List[Tuple[int, int, str]] = []
+        names = {}
+        if os.path.isfile(file_path):
+            with open(file_path, 'r', encoding='utf8', newline='') as handle:
+                for row in csv.reader(handle):
+                    if len(row) < 2 or row[0].startswith('#'):
+                        continue
+                    try:
+                        start, end, tz = parse_range(row)
+                    except ValueError:
+                        continue  # header or malformed line
+                    ranges.append((start, end, names.setdefault(tz, tz)))
+        ranges.sort()
+        self._starts = [r[0] for r in ranges]
+        self._ends = [r[1] for r in ranges]
+        self._tzs = [r[2] for r in ranges]
+        return len(ranges)
+
+    def resolve(self, ip: str) -> Optional[str]:
+        try:
+            value = ip_to_int(ip)
+        except ValueError:
+            return None
+        idx = bisect.bisect_right(self._starts, value) - 1
+        if idx >= 0 and value <= self._ends[idx]:
+            return self._tzs[idx]
+        return None
+
+
+def fetch_timezones(ips: List[str], timeout: float) -> Dict[str, Optional[str]]:
+    data = requests.post(
+        'http://ip-api.com/batch?fields=status,timezone,query',
+        json=ips,
+        timeout=timeout
+    ).json()
+    return {entry['query']: entry.get('timezone') if entry['status'] == 'success' else None for entry in data}
+
+
+class TimezoneCache:
+    def __init__(self):
+        self.entries: Dict[str, Tuple[Optional[str], float]] = {}
+        self.file_path: Optional[str] = None
+        self._lock = Lock()
+
+    def load(self, file_path: str):
+        self.file_path = file_path
+        now = time.time()
+        data = {}
+        if os.path.isfile(file_path):
+            try:
+                with open(file_path, 'r', encoding='utf8') as handle:
+                    data = json.load(handle)
+            except Exception:
+                data = {}
+        with self._lock:
+            self.entries = {ip: (tz, expire) for ip, (tz, expire) in data.items() if expire > now}
+
+    def save(self):
+        with self._lock:
+            data = dict(self.entries)
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            json.dump(data, file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.file_path)
+
+    def contains(self, ip: str) -> bool:
+        entry = self.entries.get(ip)
+        return entry is not None and entry[1] > time.time()
+
+    def get(self, ip: str) -> Optional[str]:
+        entry = self.entries.get(ip)
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+        return None
+
+    def put(self, ip: str, tz: Optional[str], ttl: float):
+        with self._lock:
+            self.entries[ip] = tz, time.time() + ttl
+
+
+class TimezonePrefetcher:
+    BATCH_SIZE = 100  # limit of the ip-api batch endpoint
+
+    def __init__(self, cache: TimezoneCache):
+        self.cache = cache
+        self._pending: List[str] = []
+        self._lock = Lock()
+        self._running = False
+
+    def request(self, ip: str):
+        if not ip or self.cache.contains(ip):
+            return
+        with self._lock:
+            if ip in self._pending:
+                return
+            self._pending.append(ip)
+            if self._running:
+                return
+            self._running = True
+        self._run()
+
+    @new_thread('division_tz_prefetch')
+    def _run(self):
+        from division.entry import config, server_inst
+        time.sleep(config.tz_batch_delay)  # let a burst of logins pile up into one batch
+        while True:
+            with self._lock:
+                batch = self._pending[:self.BATCH_SIZE]
+                del self._pending[:self.BATCH_SIZE]
+                if len(batch) == 0:
+                    self._running = False
+                    return
+            start = time.perf_counter()
+            try:
+                result = fetch_timezones(batch, config.tz_request_timeout)
+            except Exception as e:
+                server_inst.logger.warning(f'Failed to fetch timezones of {len(batch)} ips: {e}')
+                metrics.add('tz.fetch_errors')
+                result = {}
+            metrics.observe('tz.fetch', time.perf_counter() - start)
+            metrics.add('tz.fetched_ips', len(batch))
+            for ip in batch:
+                tz = result.get(ip)
+                self.cache.put(ip, tz, config.tz_cache_ttl if tz is not None else config.tz_negative_ttl)
+            try:
+                self.cache.save()
+            except Exception as e:
+                server_inst.logger.warning(f'Failed to save timezone cache: {e}')
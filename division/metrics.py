@@ -0,0 +1,143 @@
+import bisect
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Any, Callable, Dict
+
+# upper bounds of the latency buckets, in milliseconds
+BOUNDS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+
+class Histogram:
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BOUNDS)
+
+    def add(self, ms: float):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(BOUNDS, ms)] += 1
+
+    def percentile(self, pct: float) -> float:
+        # upper bound of the bucket the value falls in, capped by the largest value seen
+        rank = pct / 100 * self.count
+        seen = 0
+        for bound, count in zip(BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 4) if self.count > 0 else 0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 3),
+            'buckets': {str(bound): count for bound, count in zip(BOUNDS, self.buckets) if count > 0}
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = True
+        self.since = time.time()
+        self._lock = Lock()
+        self._timers: Dict[str, Histogram] = defaultdict(Histogram)
+        self._counters: Dict[str, int] = defaultdict(int)
+
+    def observe(self, name: str, seconds: float):
+        if self.enabled:
+            with self._lock:
+                self._timers[name].add(seconds * 1000)
+
+    def add(self, name: str, value: int = 1):
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += value
+
+    def timed(self, name: str, func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrap(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start)
+        return wrap
+
+    def instrument(self, obj: Any, prefix: str, apis: tuple):
+        # times every public method the given interfaces declare, on this instance only
+        names = {name for api in apis for name, value in vars(api).items()
+                 if callable(value) and not name.startswith('_')}
+        for name in sorted(names):
+            method = getattr(obj, name, None)
+            if method is not None:
+                setattr(obj, name, self.timed(f'{prefix}.{name}', method))
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self.since = time.time()
+
+    def timers(self) -> Dict[str, Histogram]:
+        with self._lock:
+            return dict(self._timers)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'since': self.since,
+                'time': time.time(),
+                'timers': {name: hist.to_dict() for name, hist in sorted(self._timers.items())},
+                'counters': dict(sorted(self._counters.items()))
+            }
+
+    def dump(self, file_path: str):
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            json.dump(self.snapshot(), file, indent=2)
+        os.replace(tmp_path, file_path)
+
+
+class TimedLock:
+    # a lock that records how long an acquire waited whenever the lock was already held
+    def __init__(self, lock, name: str):
+        self._inner = lock
+        self.name = name
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        if self._inner.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        rst = self._inner.acquire(blocking, timeout)
+        metrics.observe(self.name, time.perf_counter() - start)
+        return rst
+
+    def release(self):
+        self._inner.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+metrics: Metrics = Metrics()
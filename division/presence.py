@@ -0,0 +1,90 @@
+import time
+from threading import RLock
+from typing import Dict, List, Optional
+
+from division.storage.order import OrderIndex
+from division.storage.storage import Storage, PlayerStorage
+
+
+class Presence:
+    # latest online times and last checked times are kept here and written to the storage in batches
+    def __init__(self):
+        self.storage: Optional[PlayerStorage] = None
+        self.flushed = 0
+        self._lock = RLock()
+        self._times: Dict[str, float] = {}
+        self._order = OrderIndex()
+        self._dirty: Dict[str, float] = {}
+        self._checked: Dict[str, float] = {}
+        self._dirty_checked: Dict[str, float] = {}
+
+    def load(self, storage: (Storage, PlayerStorage)):
+        times = storage.get_latest_online_times()
+        with self._lock:
+            self.storage = storage
+            self._times = times
+            self._order = OrderIndex()
+            for name, time_t in times.items():
+                self._order.set(name, -time_t)
+            self._dirty.clear()
+            self._checked.clear()
+            self._dirty_checked.clear()
+
+    def touch(self, name: str, time_t: float = None):
+        time_t = time.time() if time_t is None else time_t
+        with self._lock:
+            self._times[name] = time_t
+            self._order.set(name, -time_t)
+            self._dirty[name] = time_t
+
+    def remove(self, name: str):
+        with self._lock:
+            self._times.pop(name, None)
+            self._order.remove(name)
+            self._dirty.pop(name, None)
+            self._checked.pop(name, None)
+            self._dirty_checked.pop(name, None)
+
+    def check(self, name: str, time_t: float):
+        with self._lock:
+            if time_t > self._checked.get(name, 0):
+                self._checked[name] = time_t
+                self._dirty_checked[name] = time_t
+
+    def last_checked(self, name: str, stored: float) -> float:
+        # the stored value may be older than one that hasn't been flushed yet
+        with self._lock:
+            return max(self._checked.get(name, 0), stored)
+
+    def get(self, name: str) -> Optional[float]:
+        with self._lock:
+            return self._times.get(name)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._times)
+
+    def get_range(self, start: int, stop: Optional[int] = None) -> List[str]:
+        with self._lock:
+            return self._order.slice(start, stop)
+
+    def flush(self):
+        self._flush(self._dirty, 'update_latest_online_times', 'latest online times')
+        self._flush(self._dirty_checked, 'update_last_checked', 'last checked times')
+
+    def _flush(self, pending: Dict[str, float], method: str, what: str):
+        with self._lock:
+            dirty = dict(pending)
+            pending.clear()
+        if len(dirty) == 0 or self.storage is None:
+            return
+        try:
+            getattr(self.storage, method)(dirty)
+        except Exception:
+            with self._lock:
+                for name, time_t in dirty.items():
+                    pending.setdefault(name, time_t)  # retried with the next flush
+            from division.entry import server_inst
+            server_inst.logger.exception(f'Failed to save {what}')
+        else:
+            self.flushed += len(dirty)
@@ -0,0 +1,70 @@
+import heapq
+import time
+from itertools import count
+from threading import Condition
+from typing import Callable, List, Optional
+
+from mcdreforged.api.all import *
+
+
+class Task:
+    def __init__(self, deadline: float, callback: Callable, interval: Optional[float] = None):
+        self.deadline = deadline
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+
+
+class Scheduler:
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._seq = count()
+        self._cond = Condition()
+        self._running = False
+
+    def schedule(self, delay: float, callback: Callable) -> Task:
+        return self._push(Task(time.time() + delay, callback))
+
+    def every(self, interval: float, callback: Callable) -> Task:
+        if interval <= 0:
+            raise ValueError(f'Interval must be positive, got {interval}')
+        return self._push(Task(time.time() + interval, callback, interval))
+
+    def cancel(self, task: Task):
+        with self._cond:
+            task.cancelled = True
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._cond.notify()
+
+    def _push(self, task: Task) -> Task:
+        with self._cond:
+            heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+            if not self._running:
+                self._running = True
+                self._run()
+            self._cond.notify()
+        return task
+
+    @new_thread('division_scheduler')
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (len(self._heap) == 0 or self._heap[0][0] > time.time()):
+                    self._cond.wait(None if len(self._heap) == 0 else self._heap[0][0] - time.time())
+                if not self._running:
+                    return
+                deadline, seq, task = heapq.heappop(self._heap)
+                if task.cancelled:
+                    continue
+                if task.interval is not None:
+                    task.deadline = deadline + task.interval
+                    heapq.heappush(self._heap, (task.deadline, next(self._seq), task))
+            try:
+                task.callback()
+            except Exception:
+                from division.entry import server_inst
+                server_inst.logger.exception('Error in scheduled task')
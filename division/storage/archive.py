@@ -0,0 +1,66 @@
+import gzip
+import json
+import os
+from threading import RLock
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+from mcdreforged.api.all import *
+
+from division.storage.storage import Msg
+from division.constants import ARCHIVE_SUFFIX
+
+
+class MsgArchive:
+    # expired messages of each item, appended to a gzip file of json lines that is never rewritten
+    def __init__(self):
+        self.folder: Optional[str] = None
+        self._lock = RLock()
+        self._until: Dict[Tuple[str, str], float] = {}
+
+    def open(self, folder: str):
+        with self._lock:
+            self.folder = folder
+            self._until.clear()
+
+    def path(self, kind: str, name: str) -> str:
+        return os.path.join(self.folder, kind, quote(name, safe='') + ARCHIVE_SUFFIX)
+
+    def append(self, kind: str, name: str, msgs: List[Msg]):
+        path = self.path(kind, name)
+        lines = ''.join(json.dumps(serialize(msg)) + '\n' for msg in msgs).encode('utf8')
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'ab') as file:
+                # every append is a gzip member of its own, readers see the members as one stream
+                file.write(gzip.compress(lines))
+                file.flush()
+                os.fsync(file.fileno())
+            if (kind, name) in self._until:
+                self._until[kind, name] = max(self._until[kind, name], msgs[-1].time)
+
+    def archived_until(self, kind: str, name: str) -> float:
+        # time of the last archived message, read from the file once and then kept up to date by append()
+        with self._lock:
+            if (kind, name) not in self._until:
+                self._until[kind, name] = max((msg.time for msg in self.iter(kind, name)), default=0.0)
+            return self._until[kind, name]
+
+    def iter(self, kind: str, name: str) -> Iterator[Msg]:
+        path = self.path(kind, name)
+        if self.folder is None or not os.path.isfile(path):
+            return
+        try:
+            with gzip.open(path, 'rt', encoding='utf8') as file:
+                for line in file:
+                    if line.strip() != '':
+                        yield deserialize(json.loads(line), Msg)
+        except (EOFError, gzip.BadGzipFile):
+            from division.entry import server_inst
+            server_inst.logger.warning(f'Archive {path} ends with an incomplete write, the rest is skipped')
+
+    def remove(self, kind: str, name: str):
+        with self._lock:
+            self._until.pop((kind, name), None)
+            if self.folder is not None and os.path.isfile(self.path(kind, name)):
+                os.remove(self.path(kind, name))
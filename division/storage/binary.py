@@ -0,0 +1,144 @@
+import json
+import struct
+import sys
+from collections import OrderedDict
+from itertools import accumulate
+from typing import Dict, List, Type
+
+from mcdreforged.api.all import *
+
+from division.storage.storage import Item, Group, Player, Msg
+
+# header: magic, format version, item kind, item count
+# string table: count, char lengths, then every string concatenated as utf8
+# item: name, perm, color, list length, [ip, latest_online_time, last_checked], list, msg count, times, senders, texts
+MAGIC = b'DIVB'
+VERSION = 2
+KINDS = {Group: 0, Player: 1}
+HEADER = struct.Struct('<4sBBI')
+U32 = struct.Struct('<I')
+ITEM = struct.Struct('<IiII')
+PLAYER = struct.Struct('<Idd')
+PLAYER_V1 = struct.Struct('<Id')  # version 1 had no last_checked
+
+
+class StringTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def __call__(self, text: str) -> int:
+        idx = self.ids.get(text)
+        if idx is None:
+            idx = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return idx
+
+
+def encode(items: 'OrderedDict[str, Item]', item_type: Type) -> bytes:
+    table = StringTable()
+    is_player = item_type is Player
+    body: List[bytes] = []
+    for name, item in items.items():
+        body.append(ITEM.pack(table(name), item.perm, table(item.color), len(item.list)))
+        if is_player:
+            body.append(PLAYER.pack(table(item.ip), item.latest_online_time, item.last_checked))
+        n = len(item.msg)
+        body.append(struct.pack(f'<{len(item.list)}II{n}d{n}I{n}I',
+                                *map(table, item.list), n,
+                                *(m.time for m in item.msg),
+                                *(table(m.sender) for m in item.msg),
+                                *(table(m.text) for m in item.msg)))
+    blob = ''.join(table.strings).encode('utf8', 'surrogatepass')
+    count = len(table.strings)
+    return b''.join([
+        HEADER.pack(MAGIC, VERSION, KINDS[item_type], len(items)),
+        struct.pack(f'<II{count}I', count, len(blob), *map(len, table.strings)),
+        blob,
+        *body
+    ])
+
+
+def decode(raw: bytes, item_type: Type) -> 'OrderedDict[str, Item]':
+    magic, version, kind, item_count = HEADER.unpack_from(raw, 0)
+    if magic != MAGIC or version not in (1, VERSION):
+        raise ValueError('Not a division binary storage file')
+    if kind != KINDS[item_type]:
+        raise ValueError(f'Binary storage file does not contain {item_type.__name__} items')
+    offset = HEADER.size
+    count, blob_size = struct.unpack_from('<II', raw, offset)
+    offset += 8
+    lengths = struct.unpack_from(f'<{count}I', raw, offset)
+    offset += 4 * count
+    text = raw[offset:offset + blob_size].decode('utf8', 'surrogatepass')
+    offset += blob_size
+    bounds = [0, *accumulate(lengths)]
+    strings = [text[bounds[i]:bounds[i + 1]] for i in range(count)]
+
+    is_player = item_type is Player
+    player_struct = PLAYER if version == VERSION else PLAYER_V1
+    items = OrderedDict()
+    for _ in range(item_count):
+        name, perm, color, list_size = ITEM.unpack_from(raw, offset)
+        offset += ITEM.size
+        item = item_type.__new__(item_type)  # skips the reflection done by deserialize()
+        item.perm, item.color = perm, strings[color]
+        if is_player:
+            ip, item.latest_online_time, *last_checked = player_struct.unpack_from(raw, offset)
+            item.ip, item.last_checked = strings[ip], last_checked[0] if last_checked else 0
+            offset += player_struct.size
+        item.list = [strings[i] for i in struct.unpack_from(f'<{list_size}I', raw, offset)]
+        offset += 4 * list_size
+        n = U32.unpack_from(raw, offset)[0]
+        offset += 4
+        times = struct.unpack_from(f'<{n}d', raw, offset)
+        offset += 8 * n
+        senders_texts = struct.unpack_from(f'<{2 * n}I', raw, offset)
+        offset += 8 * n
+        msgs = []
+        for i in range(n):
+            msg = Msg.__new__(Msg)
+            msg.time, msg.sender, msg.text = times[i], strings[senders_texts[i]], strings[senders_texts[n + i]]
+            msgs.append(msg)
+        item.msg = msgs
+        items[strings[name]] = item
+    if offset != len(raw):
+        raise ValueError('Trailing data in binary storage file')
+    return items
+
+
+def guess_item_type(data: dict) -> Type:
+    for item in data.values():
+        return Player if 'latest_online_time' in item else Group
+    return Group
+
+
+def json_to_binary(src: str, dst: str) -> int:
+    with open(src, 'r', encoding='utf8') as file:
+        data = json.load(file)
+    item_type = guess_item_type(data)
+    items = deserialize(data, OrderedDict[str, item_type])
+    with open(dst, 'wb') as file:
+        file.write(encode(items, item_type))
+    return len(items)
+
+
+def binary_to_json(src: str, dst: str) -> int:
+    with open(src, 'rb') as file:
+        raw = file.read()
+    item_type = Player if HEADER.unpack_from(raw, 0)[2] == KINDS[Player] else Group
+    items = decode(raw, item_type)
+    with open(dst, 'w', encoding='utf8') as file:
+        json.dump(serialize(items), file, indent=4, ensure_ascii=False)
+    return len(items)
+
+
+if __name__ == '__main__':
+    # python -m division.storage.binary players.json players.bin (or the other way round)
+    if len(sys.argv) != 3:
+        print(f'Usage: python -m division.storage.binary <src> <dst>')
+        sys.exit(1)
+    if sys.argv[1].endswith('.json'):
+        print(f'Converted {json_to_binary(sys.argv[1], sys.argv[2])} items')
+    else:
+        print(f'Converted {binary_to_json(sys.argv[1], sys.argv[2])} items')
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = RLock()
+        self._generation = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any, int]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, self._data[key], self._generation
+            self.misses += 1
+            return False, None, self._generation
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return  # invalidated while the value was being fetched
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class VersionTable:
+    def __init__(self):
+        self._versions: Dict[Hashable, int] = {}
+        self._clock = 0
+        self._base = 0
+        self._lock = RLock()
+
+    def get(self, key: Hashable) -> int:
+        return max(self._versions.get(key, 0), self._base)
+
+    def bump(self, key: Hashable):
+        with self._lock:
+            self._clock += 1
+            self._versions[key] = self._clock
+
+    def bump_all(self):
+        with self._lock:
+            self._clock += 1
+            self._base = self._clock
+            self._versions.clear()
@@ -1,14 +1,45 @@
 import json
 import os
+import time
 from threading import RLock
-from typing import List, Optional, Type, Callable
-from collections import OrderedDict
+from typing import List, Optional, Type, Callable, Dict, Set, Tuple
+from collections import OrderedDict, defaultdict
 from abc import ABCMeta, abstractmethod
 
 from mcdreforged.api.all import *
 
-from division.storage.storage import Storage, GroupStorage, PlayerStorage, OtherStorage, Item, Group, Player
-from division.constants import GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE, GROUP_OF_ALL
+from division.storage.storage import Storage, GroupStorage, PlayerStorage, OtherStorage, MembershipStorage, Item, \
+    Group, Player, Msg
+from division.storage.cache import VersionTable
+from division.storage.index import NameIndex
+from division.storage.order import OrderIndex
+from division.storage.journal import Journal
+from division.storage import binary
+from division.metrics import metrics, TimedLock
+from division.constants import GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE, GROUP_OF_ALL, JOURNAL_SUFFIX, \
+    STORAGE_FORMATS
+
+
+def storage_path(file_path: str, storage_format: str) -> str:
+    return os.path.splitext(file_path)[0] + STORAGE_FORMATS[storage_format]
+
+
+def read_snapshot(file_path: str, storage_format: str, item_type: Type) -> OrderedDict:
+    with open(file_path, 'rb') as handle:
+        raw = handle.read()
+    if storage_format == 'binary':
+        return binary.decode(raw, item_type)
+    return deserialize(json.loads(raw.decode('utf8')), OrderedDict[str, item_type])
+
+
+def fsync_dir(folder: str):
+    if os.name != 'posix':
+        return
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 class DirectOtherStorage(OtherStorage):
@@ -30,14 +61,58 @@ class DirectOtherStorage(OtherStorage):
             self.group_for_all.append(name)
 
     def remove_group_for_all(self, name):
-        if name not in self.group_for_all:
+        if name in self.group_for_all:
             self.group_for_all.remove(name)
 
 
+class DirectMembershipStorage(MembershipStorage):
+    def __init__(self, group_storage: Storage):
+        self.group_storage = group_storage
+        self.groups: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = RLock()
+
+        for name in group_storage.get_all_names():
+            for player in group_storage.get(name).list:
+                self.groups[player].add(name)
+
+    def add(self, group: str, player: str) -> bool:
+        with self._lock:
+            if self.group_storage.join(group, player):
+                self.groups[player].add(group)
+                return True
+            return False
+
+    def remove(self, group: str, player: str) -> bool:
+        with self._lock:
+            if self.group_storage.leave(group, player):
+                self.groups[player].discard(group)
+                return True
+            return False
+
+    def groups_of(self, player: str) -> List[str]:
+        with self._lock:
+            return sorted(self.groups.get(player, ()))
+
+    def remove_group(self, group: str):
+        with self._lock:
+            item = self.group_storage.get(group)
+            for player in [] if item is None else item.list:
+                self.groups[player].discard(group)
+
+
 class DirectStorage(Storage, metaclass=ABCMeta):
     def __init__(self):
-        self.items: OrderedDict[str, Item] = OrderedDict()
-        self._lock = RLock()
+        self.items: Dict[str, Item] = {}
+        self._order = OrderIndex()
+        self._lock = TimedLock(RLock(), 'direct.lock_wait')
+        self._save_lock = RLock()
+        self._file_path: Optional[str] = None
+        self._format = 'json'
+        self._journal: Optional[Journal] = None
+        self._last_compact = time.time()
+        self._compacting = False
+        self._index = NameIndex()
+        self._versions = VersionTable()
 
     @abstractmethod
     def get_storage_file(self) -> str:
@@ -51,6 +126,22 @@ class DirectStorage(Storage, metaclass=ABCMeta):
         with self._lock:
             return self.items.get(name)
 
+    def get_many(self, names: List[str]) -> List[Optional[Item]]:
+        # copied under one lock, so all the items are seen at the same point in time
+        with self._lock:
+            return [None if item is None else item.snapshot() for item in map(self.items.get, names)]
+
+    def get_msgs_after(self, names: List[str], time_t: float) -> List[Optional[Tuple[int, List[Msg]]]]:
+        rst = []
+        with self._lock:
+            for item in map(self.items.get, names):
+                if item is None:
+                    rst.append(None)
+                else:
+                    start = item.msgs_after(time_t)
+                    rst.append((start, item.msg[start:]))
+        return rst
+
     def contains(self, name: str) -> bool:
         with self._lock:
             return name in self.items
@@ -60,126 +151,328 @@ class DirectStorage(Storage, metaclass=ABCMeta):
             if self.contains(name):
                 return False
             else:
-                self.items[name] = item
-                self._save()
+                self._mutate('add_item', name, item)
                 return True
 
     def pop_item(self, name: str) -> Item:
-        with self._lock:
-            r = self.items.pop(name, default=None)
-            self._save()
-            return r
+        return self._mutate('pop_item', name)
 
     def for_each(self, callback: Callable):
-        with self._lock:
-            for item in self.items:
-                callback(item, self.items[item])
-            self._save()
+        # the callback changes items in place, which the journal can't record, so a snapshot is written instead
+        with self._save_lock:
+            with self._lock:
+                for item in self._order:
+                    callback(item, self.items[item])
+                self._versions.bump_all()
+                self._snapshot()
 
     def change_perm(self, name: str, level: int):
         with self._lock:
-            item = self.get(name)
-            if not item:
+            if not self.contains(name):
                 raise Exception('No such item')
-            else:
-                item.perm = level
-                self._save()
+            self._mutate('change_perm', name, level)
 
     def change_color(self, name: str, color: str):
         with self._lock:
-            item = self.get(name)
-            if not item:
+            if not self.contains(name):
                 raise Exception('No such item')
-            else:
-                item.color = color
-                self._save()
-                return True
+            self._mutate('change_color', name, color)
+            return True
 
     def join(self, item, value) -> bool:
-        with self._lock:
-            r = self.items.get(item).join(value)
-            self._save()
-            return r
+        return self._mutate('join', item, value)
 
     def leave(self, item, value) -> bool:
-        with self._lock:
-            r = self.items.get(item).leave(value)
-            self._save()
-            return r
+        return self._mutate('leave', item, value)
 
     def add_msg(self, item, sender, text):
-        with self._lock:
-            self.items.get(item).add_msg(sender, text)
-            self._save()
+        self._mutate('add_msg', item, time.time(), sender, text)
 
     def edit_msg(self, item, line, text):
-        with self._lock:
-            self.items.get(item).edit_msg(line, text)
-            self._save()
+        self._mutate('edit_msg', item, line, text)
 
     def del_msg(self, item, line):
-        with self._lock:
-            self.items.get(item).del_msg(line)
-            self._save()
+        self._mutate('del_msg', item, line)
+
+    def trim_msgs(self, item, count: int, last_time: float) -> bool:
+        return self._mutate('trim_msgs', item, count, last_time)
 
     def get_all_names(self) -> List[str]:
         with self._lock:
-            return list(self.items.keys())
+            return list(self._order)
+
+    def get_range(self, start: int, stop: Optional[int] = None) -> List[str]:
+        with self._lock:
+            return self._order.slice(start, stop)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self.items)
+
+    def search(self, keyword: str) -> List[str]:
+        return self._index.search(keyword)
+
+    def get_version(self, name: str) -> int:
+        return self._versions.get(name)
 
     def ordered_items(self, item_list: List[str]) -> List[str]:
         with self._lock:
-            r: List[str] = []
-            for name in self.items.keys():
-                if name in item_list:
-                    r.append(name)
-            return r
+            return self._order.sort(item_list)
+
+    def rank(self, name: str) -> Optional[int]:
+        with self._lock:
+            return self._order.rank(name)
 
     def place_item(self, name, pos):
         with self._lock:
             if self.contains(name) and pos < len(self.items):
-                if pos < len(self.items)/2:
-                    self.items.move_to_end(name, last=False)
-                    for i in range(pos):
-                        self.items.move_to_end(list(self.items.keys())[pos], last=False)
-                else:
-                    self.items.move_to_end(name, last=True)
-                    for i in range(len(self.items) - pos - 1):
-                        self.items.move_to_end(list(self.items.keys())[pos], last=True)
+                self._mutate('place_item', name, pos)
             else:
                 raise IndexError
 
+    def _apply_add_item(self, name: str, item: Item):
+        self.items[name] = item
+        self._index.add(name)
+        self._order.append(name)
+
+    def _apply_pop_item(self, name: str) -> Item:
+        self._index.remove(name)
+        self._order.remove(name)
+        return self.items.pop(name, None)
+
+    def _apply_change_perm(self, name: str, level: int):
+        self.items.get(name).perm = level
+
+    def _apply_change_color(self, name: str, color: str):
+        self.items.get(name).color = color
+
+    def _apply_join(self, item, value) -> bool:
+        return self.items.get(item).join(value)
+
+    def _apply_leave(self, item, value) -> bool:
+        return self.items.get(item).leave(value)
+
+    def _apply_add_msg(self, item, time_t, sender, text):
+        self.items.get(item).add_msg(sender, text, time_t)
+
+    def _apply_edit_msg(self, item, line, text):
+        self.items.get(item).edit_msg(line, text)
+
+    def _apply_del_msg(self, item, line):
+        self.items.get(item).del_msg(line)
+
+    def _apply_trim_msgs(self, item, count, last_time) -> bool:
+        msgs = self.items[item].msg if item in self.items else []
+        if count <= 0 or len(msgs) < count or msgs[count - 1].time != last_time:
+            return False
+        del msgs[:count]
+        return True
+
+    def _apply_place_item(self, name, pos):
+        self._order.place(name, pos)
+
+    def _mutate(self, op: str, *args):
+        with self._lock:
+            r = getattr(self, f'_apply_{op}')(*args)
+            if isinstance(args[0], str):  # batched ops bump their items themselves
+                self._versions.bump(args[0])
+            if r is not False:
+                if self._journal is None:
+                    self._save()
+                else:
+                    self._journal.append(serialize([op, *args]))
+                    self._check_compact()
+            return r
+
+    def _replay(self, journal_path: str) -> int:
+        from division.entry import server_inst
+        count = 0
+        for record in Journal.read(journal_path):
+            op, args = record[0], record[1:]
+            try:
+                if op == 'add_item':
+                    args[1] = deserialize(args[1], self.get_item_type())
+                getattr(self, f'_apply_{op}')(*args)
+            except Exception as e:
+                server_inst.logger.warning(f'Skipped journal record {record} of {journal_path}: {e}')
+            count += 1
+        return count
+
     def load(self, file_path: str) -> bool:
+        from division.entry import config, server_inst
         with self._lock:
             folder = os.path.dirname(file_path)
             if not os.path.isdir(folder):
                 os.makedirs(folder)
-            self.items.clear()
-            needs_overwrite = False
-            if not os.path.isfile(file_path):
-                needs_overwrite = True
+            storage_format = config.storage_format if config.storage_format in STORAGE_FORMATS else 'json'
+            target_path = storage_path(file_path, storage_format)
+            needs_overwrite = None
+            if not os.path.isfile(target_path):
+                for source_format in STORAGE_FORMATS:
+                    source_path = storage_path(file_path, source_format)
+                    if source_format != storage_format and os.path.isfile(source_path):
+                        self._load_file(source_path, source_format)
+                        self._file_path, self._format = target_path, storage_format
+                        self._save()
+                        backup_path = f'{source_path}.{int(time.time())}.bak'
+                        os.replace(source_path, backup_path)
+                        if os.path.isfile(source_path + JOURNAL_SUFFIX):
+                            os.remove(source_path + JOURNAL_SUFFIX)  # already folded into the snapshot
+                        server_inst.logger.info(f'Converted {source_path} to {target_path}, moved the old file to {backup_path}')
+                        needs_overwrite = False
+                        break
+            if needs_overwrite is None:
+                needs_overwrite = self._load_file(target_path, storage_format)
+            if config.journal:
+                self._journal = Journal(target_path + JOURNAL_SUFFIX)
+                self._last_compact = time.time()
+        return needs_overwrite
+
+    def _load_file(self, file_path: str, storage_format: str) -> bool:
+        self._file_path, self._format = file_path, storage_format
+        journal_path = file_path + JOURNAL_SUFFIX
+        old_journal_path = journal_path + '.old'
+        tmp_path = file_path + '.tmp'
+        if os.path.isfile(tmp_path):
+            if not os.path.isfile(old_journal_path) and self._is_valid_snapshot(tmp_path):
+                os.replace(tmp_path, file_path)  # written completely but not renamed yet
             else:
-                with open(file_path, 'r', encoding='utf8') as handle:
-                    data = None
-                    try:
-                        data = json.load(handle)
-                        items = deserialize(data, OrderedDict[str, self.get_item_type()])
-                    except Exception as e:
-                        from division.entry import server_inst
-                        server_inst.logger.error(f'Fail to load {file_path}: {e}')
-                        server_inst.logger.error(f'Unknown data: {data}')
-                        needs_overwrite = True
-                    else:
-                        self.items = items
+                os.remove(tmp_path)
+        self.items = {}
+        needs_overwrite = False
+        if not os.path.isfile(file_path):
+            needs_overwrite = True
+        else:
+            try:
+                self.items = self._parse(file_path)
+            except Exception as e:
+                from division.entry import server_inst
+                server_inst.logger.error(f'Fail to load {file_path}: {e}')
+                needs_overwrite = True
             if needs_overwrite:
-                self._save()
+                backup_path = f'{file_path}.{int(time.time())}.bak'
+                os.replace(file_path, backup_path)
+                from division.entry import server_inst
+                server_inst.logger.error(f'Moved {file_path} to {backup_path}')
+        self._index = NameIndex(self.items.keys())
+        self._order = OrderIndex(self.items.keys())
+        self._versions.bump_all()
+        if os.path.isfile(old_journal_path):
+            self._replay(old_journal_path)
+            self._write_snapshot(self._dump(), old_journal_path)
+        if os.path.isfile(journal_path) and os.path.getsize(journal_path) > 0:
+            self._replay(journal_path)
+            os.replace(journal_path, old_journal_path)
+            self._write_snapshot(self._dump(), old_journal_path)
+        if needs_overwrite:
+            self._save()
         return needs_overwrite
 
+    def close(self):
+        if self._journal is not None:
+            self._compact()
+            with self._lock:
+                self._journal.close()
+                self._journal = None
+
+    def _check_compact(self):
+        from division.entry import config
+        if self._compacting:
+            return
+        if self._journal.size >= config.journal_compact_size or \
+                time.time() - self._last_compact >= config.journal_compact_interval:
+            self._compacting = True
+            self._compact_async()
+
+    @new_thread('division_compact')
+    def _compact_async(self):
+        try:
+            self._compact()
+        finally:
+            self._compacting = False
+
+    def _compact(self):
+        with self._save_lock:
+            with self._lock:
+                if self._journal is None or self._journal.size == 0:
+                    return
+                if os.path.isfile(self._journal.old_file_path):  # a previous compaction failed
+                    return
+                data = self._dump()
+                old_journal_path = self._journal.rotate()
+                self._last_compact = time.time()
+            try:
+                self._write_snapshot(data, old_journal_path)
+            except Exception as e:
+                from division.entry import server_inst
+                server_inst.logger.exception(f'Fail to compact {self._file_path}: {e}')
+
+    def _snapshot(self):
+        # everything in memory, the journal records it covers are retired with it
+        with self._save_lock:
+            with self._lock:
+                if self._journal is None:
+                    self._save()
+                    return
+                if os.path.isfile(self._journal.old_file_path):
+                    self._retire_old_journal()
+                data = self._dump()
+                old_journal_path = self._journal.rotate() if self._journal.size > 0 else None
+                self._last_compact = time.time()
+                self._write_snapshot(data, old_journal_path)
+
+    def _retire_old_journal(self):
+        # an earlier compaction failed to write its snapshot, that snapshot is rebuilt from disk and written first
+        scratch = type(self)()
+        scratch._file_path, scratch._format = self._file_path, self._format
+        if os.path.isfile(self._file_path):
+            scratch.items = self._parse(self._file_path)
+        scratch._order = OrderIndex(scratch.items.keys())
+        scratch._replay(self._journal.old_file_path)
+        self._write_snapshot(scratch._dump(), self._journal.old_file_path)
+
+    def _dump(self) -> bytes:
+        from division.entry import config
+        with self._lock:
+            items = OrderedDict((name, self.items[name]) for name in self._order)
+            if self._format == 'binary':
+                return binary.encode(items, self.get_item_type())
+            if config.compact_json:
+                return json.dumps(serialize(items), ensure_ascii=False, separators=(',', ':')).encode('utf8')
+            return json.dumps(serialize(items), indent=4, ensure_ascii=False).encode('utf8')
+
+    def _parse(self, file_path: str) -> OrderedDict:
+        return read_snapshot(file_path, self._format, self.get_item_type())
+
+    def _write_snapshot(self, data: bytes, retired_journal: Optional[str] = None):
+        start = time.perf_counter()
+        tmp_path = self._file_path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        if retired_journal is not None:
+            os.remove(retired_journal)  # commit point
+        os.replace(tmp_path, self._file_path)
+        fsync_dir(os.path.dirname(self._file_path))
+        metrics.observe('direct.save', time.perf_counter() - start)
+        metrics.add('direct.save_bytes', len(data))
+
+    def _is_valid_snapshot(self, file_path: str) -> bool:
+        try:
+            with open(file_path, 'rb') as handle:
+                raw = handle.read()
+            if self._format == 'binary':
+                binary.decode(raw, self.get_item_type())
+            else:
+                json.loads(raw.decode('utf8'))
+        except Exception:
+            return False
+        return True
+
     def _save(self):
         with self._lock:
-            from division.entry import server_inst
-            file_path = os.path.join(server_inst.get_data_folder(), self.get_storage_file())
-            with open(file_path, 'w', encoding='utf8') as file:
-                json.dump(serialize(self.items), file, indent=4, ensure_ascii=False)
+            self._write_snapshot(self._dump())
 
 
 class DirectGroupStorage(GroupStorage, DirectStorage):
@@ -193,15 +486,9 @@ class DirectGroupStorage(GroupStorage, DirectStorage):
 
 class DirectPlayerStorage(PlayerStorage, DirectStorage):
 
-    def add_item(self, name: str, item: Item) -> bool:
-        with self._lock:
-            if self.contains(name):
-                return False
-            else:
-                self.items[name] = item
-                self.items.move_to_end(name, last=False)
-                self._save()
-                return True
+    def _apply_add_item(self, name: str, item: Item):
+        super()._apply_add_item(name, item)
+        self._order.move_to_front(name)
 
     def get_storage_file(self) -> str:
         return PLAYERS_STORAGE_FILE
@@ -210,9 +497,38 @@ class DirectPlayerStorage(PlayerStorage, DirectStorage):
         return Player
 
     def update_latest_online_time(self, name):
+        self._mutate('update_latest_online_time', name, time.time())
+
+    def update_latest_online_times(self, times: Dict[str, float]):
+        self._mutate('update_latest_online_times', times)
+
+    def get_latest_online_times(self) -> Dict[str, float]:
         with self._lock:
+            return {name: self.items[name].latest_online_time for name in self._order}
+
+    def update_last_checked(self, times: Dict[str, float]):
+        self._mutate('update_last_checked', times)
+
+    def _apply_update_last_checked(self, times: Dict[str, float]):
+        for name, time_t in times.items():
             player = self.items.get(name)
             if isinstance(player, Player):
-                player.update_latest_online_time()
-            self.items.move_to_end(name, last=False)
-            self._save()
+                player.last_checked = time_t
+
+    def _apply_update_latest_online_times(self, times: Dict[str, float]):
+        for name, time_t in sorted(times.items(), key=lambda elem: elem[1]):
+            self._apply_update_latest_online_time(name, time_t)
+            self._versions.bump(name)
+
+    def _apply_update_latest_online_time(self, name, time_t):
+        player = self.items.get(name)
+        if isinstance(player, Player):
+            player.update_latest_online_time(time_t)
+            self._order.move_to_front(name)
+
+
+def read_storage(file_path: str, storage_format: str, item_type: Type) -> OrderedDict:
+    # the snapshot with the journals left by an unclean shutdown replayed on top, as a direct storage would load it
+    storage = DirectGroupStorage() if item_type is Group else DirectPlayerStorage()
+    storage._load_file(file_path, storage_format)
+    return OrderedDict((name, storage.items[name]) for name in storage._order)
@@ -0,0 +1,60 @@
+from collections import defaultdict
+from threading import RLock
+from typing import Dict, Iterable, List, Set
+
+
+def grams(text: str, n: int) -> Set[str]:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def rank(keyword: str, name: str) -> tuple:
+    if name == keyword:
+        tier = 0
+    elif name.startswith(keyword):
+        tier = 1
+    else:
+        tier = 2
+    return tier, len(name), name
+
+
+class NameIndex:
+    MAX_GRAM = 3
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._names: Set[str] = set()
+        self._grams: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = RLock()
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str):
+        with self._lock:
+            if name in self._names:
+                return
+            self._names.add(name)
+            for n in range(1, self.MAX_GRAM + 1):
+                for gram in grams(name, n):
+                    self._grams[gram].add(name)
+
+    def remove(self, name: str):
+        with self._lock:
+            if name not in self._names:
+                return
+            self._names.discard(name)
+            for n in range(1, self.MAX_GRAM + 1):
+                for gram in grams(name, n):
+                    names = self._grams[gram]
+                    names.discard(name)
+                    if len(names) == 0:
+                        del self._grams[gram]
+
+    def search(self, keyword: str) -> List[str]:
+        with self._lock:
+            if keyword == '':
+                matched = set(self._names)
+            elif len(keyword) <= self.MAX_GRAM:
+                matched = set(self._grams.get(keyword, ()))
+            else:
+                candidates = sorted((self._grams.get(gram, set()) for gram in grams(keyword, self.MAX_GRAM)), key=len)
+                matched = {name for name in set.intersection(*candidates) if keyword in name}
+        return sorted(matched, key=lambda name: rank(keyword, name))
@@ -0,0 +1,48 @@
+import json
+import os
+from threading import RLock
+from typing import Iterator, List
+
+from division.metrics import metrics
+
+
+class Journal:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.old_file_path = file_path + '.old'
+        self._lock = RLock()
+        self._file = open(self.file_path, 'a', encoding='utf8')
+        self.size = self._file.tell()
+
+    def append(self, record: list):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            size = len(line.encode('utf8'))
+            self.size += size
+        metrics.add('journal.bytes', size)
+        metrics.add('journal.records')
+
+    def rotate(self) -> str:
+        with self._lock:
+            self._file.close()
+            os.replace(self.file_path, self.old_file_path)
+            self._file = open(self.file_path, 'a', encoding='utf8')
+            self.size = 0
+            return self.old_file_path
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def read(file_path: str) -> Iterator[List]:
+        if not os.path.isfile(file_path):
+            return
+        with open(file_path, 'r', encoding='utf8') as handle:
+            for line in handle:
+                if not line.endswith('\n'):  # torn write
+                    return
+                yield json.loads(line)
+
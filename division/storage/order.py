@@ -0,0 +1,165 @@
+import math
+import random
+from typing import Dict, Iterable, Iterator, List, Optional
+
+MAX_LEVEL = 32
+END = (math.inf, '')
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key: tuple, level: int):
+        self.key = key
+        self.next: List[Optional[_Node]] = [None] * level
+        self.width: List[int] = [1] * level
+
+
+class OrderIndex:
+    # indexable skip list over (score, name): rank, select and insertion at a position are all O(log n)
+    GAP = 1e-6
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._tail = _Node(END, 0)
+        self._head = _Node(('HEAD',), MAX_LEVEL)
+        self._head.next = [self._tail] * MAX_LEVEL
+        self._scores: Dict[str, float] = {}
+        for name in names:
+            self.append(name)
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._scores
+
+    def __iter__(self) -> Iterator[str]:
+        node = self._head.next[0]
+        while node is not self._tail:
+            yield node.key[1]
+            node = node.next[0]
+
+    def score(self, name: str) -> Optional[float]:
+        return self._scores.get(name)
+
+    def _insert(self, score: float, name: str):
+        key = (score, name)
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        steps_at_level = [0] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        height = min(MAX_LEVEL, 1 - int(math.log(1 - random.random(), 2.0)))
+        new_node = _Node(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, MAX_LEVEL):
+            chain[level].width[level] += 1
+        self._scores[name] = score
+
+    def remove(self, name: str):
+        score = self._scores.pop(name, None)
+        if score is None:
+            return
+        key = (score, name)
+        chain: List[_Node] = [self._head] * MAX_LEVEL
+        node = self._head
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVEL):
+            chain[level].width[level] -= 1
+
+    def rank(self, name: str) -> Optional[int]:
+        score = self._scores.get(name)
+        if score is None:
+            return None
+        key = (score, name)
+        node, pos = self._head, 0
+        for level in reversed(range(MAX_LEVEL)):
+            while node.next[level].key < key:
+                pos += node.width[level]
+                node = node.next[level]
+        return pos
+
+    def _node_at(self, idx: int) -> _Node:
+        node = self._head
+        idx += 1
+        for level in reversed(range(MAX_LEVEL)):
+            while node.width[level] <= idx:
+                idx -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def select(self, idx: int) -> str:
+        if not 0 <= idx < len(self):
+            raise IndexError('order index out of range')
+        return self._node_at(idx).key[1]
+
+    def slice(self, start: int, stop: Optional[int] = None) -> List[str]:
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return []
+        names = []
+        node = self._node_at(start)
+        for _ in range(stop - start):
+            names.append(node.key[1])
+            node = node.next[0]
+        return names
+
+    def set(self, name: str, score: float):
+        self.remove(name)
+        self._insert(score, name)
+
+    def append(self, name: str):
+        self.remove(name)
+        self._insert(0 if len(self) == 0 else self._node_at(len(self) - 1).key[0] + 1, name)
+
+    def move_to_front(self, name: str):
+        self.remove(name)
+        self._insert(0 if len(self) == 0 else self._head.next[0].key[0] - 1, name)
+
+    def place(self, name: str, pos: int):
+        self.remove(name)
+        prev = self._node_at(pos - 1).key[0] if 0 < pos <= len(self) else None
+        next_ = self._node_at(pos).key[0] if 0 <= pos < len(self) else None
+        if prev is not None and next_ is not None and next_ - prev < self.GAP:
+            self._renumber()
+            prev, next_ = pos - 1, pos
+        if prev is not None and next_ is not None:
+            score = (prev + next_) / 2
+        elif prev is not None:
+            score = prev + 1
+        elif next_ is not None:
+            score = next_ - 1
+        else:
+            score = 0
+        self._insert(score, name)
+
+    def _renumber(self):
+        # the order doesn't change, so the keys can be rewritten in place
+        node, idx = self._head.next[0], 0
+        while node is not self._tail:
+            node.key = (idx, node.key[1])
+            self._scores[node.key[1]] = idx
+            node, idx = node.next[0], idx + 1
+
+    def sort(self, names: Iterable[str]) -> List[str]:
+        scored = [(self._scores[name], name) for name in names if name in self._scores]
+        scored.sort()
+        return [name for score, name in scored]
@@ -1,160 +1,618 @@
 import json
 import os
 from threading import RLock
-from typing import List, Optional, Type, Callable
+from typing import List, Optional, Type, Callable, Dict
 from collections import OrderedDict
 import time
 import bisect
 from abc import ABCMeta, abstractmethod
-from redis import Redis
+from redis import BlockingConnectionPool
+from redis.client import Script
+from redis.connection import Connection
+from redis.exceptions import ConnectionError, TimeoutError
 from rejson import Client, Path
+from rejson.client import Pipeline
 
 from mcdreforged.api.all import *
 
-from division.storage.storage import Storage, GroupStorage, PlayerStorage, OtherStorage, Item, Group, Player, Msg
+from division.storage.cache import LRUCache, VersionTable
+from division.storage.index import NameIndex
+from division.storage.storage import Storage, GroupStorage, PlayerStorage, OtherStorage, MembershipStorage, Item, \
+    Group, Player, Msg
 from division.constants import GROUPS_STORAGE_FILE, PLAYERS_STORAGE_FILE, GROUP_OF_ALL
-
-
-r: Redis
-rj: Client
-
-
-def init_redis(host: str, port: int, db: int, password: str | None):
-    global r, rj
-    r = Redis(host, port, db=db, password=password)
-    rj = Client(host=host, port=port, db=db, password=password, decode_responses=True)
+from division.metrics import metrics
+
+
+INVALIDATE_CHANNEL = 'division:invalidate'
+# commands that change nothing, so sending one again after it may have run is harmless
+READ_COMMANDS = frozenset([
+    'EXISTS', 'GET', 'SISMEMBER', 'SMEMBERS', 'SCARD', 'ZRANGE', 'ZREVRANGE', 'ZCARD', 'ZRANK', 'ZREVRANK',
+    'ZSCORE', 'JSON.GET', 'JSON.MGET', 'PING', 'SCRIPT LOAD', 'SCRIPT EXISTS'
+])
+
+rj: 'RedisClient'
+scripts: Dict[str, Script]
+cache: LRUCache = LRUCache(0)
+versions: VersionTable = VersionTable()
+listener = None
+
+# KEYS: names, order, item  ARGV: name, item, score (empty to append), only if absent
+SET_ITEM = """
+local member = redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1
+if ARGV[4] == '1' and member and redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+if not member then
+    redis.call('SADD', KEYS[1], ARGV[1])
+    redis.call('PUBLISH', 'division:invalidate', KEYS[1])
+end
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    local score = ARGV[3]
+    if score == '' then
+        local last = redis.call('ZRANGE', KEYS[2], -1, -1, 'WITHSCORES')
+        score = last[2] and tonumber(last[2]) + 1 or 0
+    end
+    redis.call('ZADD', KEYS[2], score, ARGV[1])
+end
+redis.call('JSON.SET', KEYS[3], '.', ARGV[2])
+redis.call('PUBLISH', 'division:invalidate', KEYS[3])
+return 1
+"""
+
+# KEYS: names, order, item  ARGV: name
+POP_ITEM = """
+if redis.call('SREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('PUBLISH', 'division:invalidate', KEYS[1])
+end
+redis.call('ZREM', KEYS[2], ARGV[1])
+local item = redis.call('JSON.GET', KEYS[3], '.')
+if item then
+    redis.call('JSON.DEL', KEYS[3], '.')
+    redis.call('PUBLISH', 'division:invalidate', KEYS[3])
+end
+return item
+"""
+
+# KEYS: item, reverse index (optional)  ARGV: value, join or leave, item name
+JOIN_LEAVE = """
+local lst = cjson.decode(redis.call('JSON.GET', KEYS[1], '.list'))
+local value = cjson.decode(ARGV[1])
+local lo, hi = 1, #lst + 1
+while lo < hi do
+    local mid = math.floor((lo + hi) / 2)
+    if lst[mid] < value then lo = mid + 1 else hi = mid end
+end
+local found = lst[lo] == value
+if ARGV[2] == 'join' and not found then
+    redis.call('JSON.ARRINSERT', KEYS[1], '.list', lo - 1, ARGV[1])
+    if KEYS[2] then
+        redis.call('SADD', KEYS[2], ARGV[3])
+    end
+elseif ARGV[2] == 'leave' and found then
+    redis.call('JSON.ARRPOP', KEYS[1], '.list', lo - 1)
+    if KEYS[2] then
+        redis.call('SREM', KEYS[2], ARGV[3])
+    end
+else
+    return 0
+end
+redis.call('PUBLISH', 'division:invalidate', KEYS[1])
+return 1
+"""
+
+# KEYS: names, order  ARGV: name, pos
+# scores are spread out so that a placement only looks at its two neighbours,
+# they are renumbered when two neighbours get too close
+PLACE_ITEM = """
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 0 then
+    return redis.error_reply('No such item')
+end
+local pos = tonumber(ARGV[2])
+redis.call('ZREM', KEYS[2], ARGV[1])
+local function neighbour(idx)
+    if idx < 0 then
+        return nil
+    end
+    local found = redis.call('ZRANGE', KEYS[2], idx, idx, 'WITHSCORES')
+    return found[2] and tonumber(found[2])
+end
+local prev, next = neighbour(pos - 1), neighbour(pos)
+if prev and next and next - prev < 1e-6 then
+    local names = redis.call('ZRANGE', KEYS[2], 0, -1)
+    for i, name in ipairs(names) do
+        redis.call('ZADD', KEYS[2], i - 1, name)
+    end
+    prev, next = neighbour(pos - 1), neighbour(pos)
+end
+local score
+if prev and next then
+    score = (prev + next) / 2
+elseif prev then
+    score = prev + 1
+elseif next then
+    score = next - 1
+else
+    score = 0
+end
+redis.call('ZADD', KEYS[2], score, ARGV[1])
+return 1
+"""
+
+# KEYS: order, item  ARGV: name, time
+TOUCH_ITEM = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+redis.call('JSON.SET', KEYS[2], '.latest_online_time', ARGV[2])
+redis.call('ZADD', KEYS[1], 'XX', ARGV[2], ARGV[1])
+redis.call('PUBLISH', 'division:invalidate', KEYS[2])
+return 1
+"""
+
+# KEYS: item  ARGV: path, json value
+SET_FIELD = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('JSON.SET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('PUBLISH', 'division:invalidate', KEYS[1])
+return 1
+"""
+
+# KEYS: item  ARGV: count, time of the last message to drop
+TRIM_MSGS = """
+local count = tonumber(ARGV[1])
+if redis.call('EXISTS', KEYS[1]) == 0 or redis.call('JSON.ARRLEN', KEYS[1], '.msg') < count then
+    return 0
+end
+local last = tonumber(redis.call('JSON.GET', KEYS[1], '.msg[' .. (count - 1) .. '].time'))
+if math.abs(last - tonumber(ARGV[2])) > 1e-6 then
+    return 0
+end
+redis.call('JSON.ARRTRIM', KEYS[1], '.msg', count, -1)
+redis.call('PUBLISH', 'division:invalidate', KEYS[1])
+return 1
+"""
+
+# KEYS: names  ARGV: name
+REMOVE_NAME = """
+local idx = redis.call('JSON.ARRINDEX', KEYS[1], '.', ARGV[1])
+if idx >= 0 then
+    redis.call('JSON.ARRPOP', KEYS[1], '.', idx)
+end
+return 1
+"""
+
+
+class UnsentError(ConnectionError):
+    # the connection failed before the command left this process
+    pass
+
+
+class RedisConnection(Connection):
+    def connect(self):
+        try:
+            super().connect()
+        except (ConnectionError, TimeoutError) as e:
+            raise UnsentError(str(e)) from e
+
+    def check_health(self):
+        try:
+            super().check_health()
+        except (ConnectionError, TimeoutError) as e:
+            raise UnsentError(str(e)) from e
+
+
+class RedisConnectionPool(BlockingConnectionPool):
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            return super().get_connection(command_name, *keys, **options)
+        except UnsentError:
+            raise
+        except (ConnectionError, TimeoutError) as e:
+            raise UnsentError(str(e)) from e
+
+
+class Backoff:
+    # failed commands are sent again after a delay that doubles each time. a write is only sent again when it never
+    # left, since after a timeout or a dropped connection it may have run already and running it twice appends twice
+    def __init__(self, retries: int, delay: float):
+        self.retries = retries
+        self.delay = delay
+
+    def call(self, read_only: bool, func: Callable, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except (ConnectionError, TimeoutError) as e:
+                if attempt >= self.retries or not (read_only or isinstance(e, UnsentError)):
+                    raise
+                metrics.add('redis.retries')
+                time.sleep(self.delay * 2 ** attempt)
+                attempt += 1
+
+
+def is_read(name) -> bool:
+    return str(name).upper() in READ_COMMANDS
+
+
+class RedisPipeline(Pipeline):
+    backoff: Backoff
+
+    def execute(self, raise_on_error=True):
+        # a failed execute resets the pipeline, so every attempt starts from a copy of what was queued
+        stack, pipe_scripts = list(self.command_stack), set(self.scripts)
+
+        def attempt():
+            self.command_stack, self.scripts = list(stack), set(pipe_scripts)
+            return super(RedisPipeline, self).execute(raise_on_error)
+
+        read_only = all(is_read(args[0]) for args, options in stack)
+        # a pipeline is one round trip for all of its commands
+        metrics.add('redis.commands', len(stack))
+        start = time.perf_counter()
+        try:
+            return self.backoff.call(read_only, attempt)
+        finally:
+            metrics.observe('redis.pipeline', time.perf_counter() - start)
+
+
+class RedisClient(Client):
+    # the one client every storage and the invalidation listener share, strings are utf-8 both ways
+    def __init__(self, pool: BlockingConnectionPool, backoff: Backoff):
+        super().__init__(encoder=json.JSONEncoder(ensure_ascii=False), connection_pool=pool)
+        self.backoff = backoff
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return self.backoff.call(is_read(args[0]), super().execute_command, *args, **options)
+        finally:
+            metrics.observe('redis.command', time.perf_counter() - start)
+            metrics.add('redis.commands')
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = RedisPipeline(
+            connection_pool=self.connection_pool,
+            response_callbacks=self.response_callbacks,
+            transaction=transaction,
+            shard_hint=shard_hint)
+        pipe.setEncoder(self._encoder)
+        pipe.setDecoder(self._decoder)
+        pipe.backoff = self.backoff
+        return pipe
+
+
+def init_redis(host: str, port: int, db: int, password: str | None, cache_size: int = 0, pool_size: int = 16,
+               socket_timeout: float = 5, connect_timeout: float = 3, health_check_interval: int = 30,
+               retries: int = 3, retry_delay: float = 0.1):
+    global rj, scripts, cache, listener
+    # commands wait up to socket_timeout for a free connection when all of them are in use
+    pool = RedisConnectionPool(
+        connection_class=RedisConnection,
+        max_connections=pool_size,
+        timeout=socket_timeout,
+        host=host,
+        port=port,
+        db=db,
+        password=password,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=connect_timeout,
+        health_check_interval=health_check_interval,
+        decode_responses=True
+    )
+    rj = RedisClient(pool, Backoff(retries, retry_delay))
+    scripts = {
+        'set_item': rj.register_script(SET_ITEM),
+        'pop_item': rj.register_script(POP_ITEM),
+        'join_leave': rj.register_script(JOIN_LEAVE),
+        'place_item': rj.register_script(PLACE_ITEM),
+        'touch_item': rj.register_script(TOUCH_ITEM),
+        'set_field': rj.register_script(SET_FIELD),
+        'trim_msgs': rj.register_script(TRIM_MSGS),
+        'remove_name': rj.register_script(REMOVE_NAME)
+    }
+    cache = LRUCache(cache_size)
+    versions.bump_all()
+    pubsub = rj.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(**{INVALIDATE_CHANNEL: lambda message: invalidate(message['data'])})
+    listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
+def close_redis():
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+    cache.clear()
+
+
+def invalidate(key: str):
+    cache.invalidate(key)
+    versions.bump(key)
+
+
+def publish_change(pipe, key: str):
+    invalidate(key)
+    pipe.publish(INVALIDATE_CHANNEL, key)
 
 
 
 class RedisOtherStorage(OtherStorage):
     def __init__(self):
-        if not r.exists('group_for_all'):
+        if not rj.exists('group_for_all'):
             rj.jsonset('group_for_all', Path.rootPath(), [])
 
     def get_group_for_all(self) -> List[str]:
-        data = rj.jsonget('group_for_all', Path.rootPath())
-        for i in range(len(data)):
-            data[i] = data[i].encode('latin1').decode('utf-8')
-        return data
+        return rj.jsonget('group_for_all', Path.rootPath())
 
     def add_group_for_all(self, name):
         rj.jsonarrappend('group_for_all', Path.rootPath(), name)
 
     def remove_group_for_all(self, name):
-        rj.jsonarrpop('group_for_all', Path.rootPath(), rj.jsonarrindex('group_for_all', Path.rootPath(), name))
+        scripts['remove_name'](keys=['group_for_all'], args=[json.dumps(name)])
+
+
+class RedisMembershipStorage(MembershipStorage):
+    PREFIX = 'groups:'
+
+    def __init__(self, group_storage: Storage):
+        self.group_storage = group_storage
+        # 1 once the groups are indexed by player, 2 once the lists of the players are folded into the groups
+        self.schema = int(rj.get('schema:membership') or 0)
+        if self.schema == 0:
+            pipe = rj.pipeline()
+            for name in group_storage.get_all_names():
+                for player in group_storage.get(name).list:
+                    pipe.sadd(self.PREFIX + player, name)
+            pipe.set('schema:membership', 1)
+            pipe.execute()
+            self.schema = 1
+
+    def _join_leave(self, group: str, player: str, op: str) -> bool:
+        key = self.group_storage.prefix + group
+        invalidate(key)
+        return bool(scripts['join_leave'](keys=[key, self.PREFIX + player], args=[json.dumps(player), op, group]))
+
+    def add(self, group: str, player: str) -> bool:
+        return self._join_leave(group, player, 'join')
+
+    def remove(self, group: str, player: str) -> bool:
+        return self._join_leave(group, player, 'leave')
+
+    def groups_of(self, player: str) -> List[str]:
+        return sorted(rj.smembers(self.PREFIX + player))
+
+    def remove_group(self, group: str):
+        item = self.group_storage.get(group)
+        if item is None:
+            return
+        pipe = rj.pipeline(transaction=False)
+        for player in item.list:
+            pipe.srem(self.PREFIX + player, group)
+        pipe.execute()
+
+    def lists_migrated(self) -> bool:
+        return self.schema >= 2
+
+    def mark_lists_migrated(self):
+        rj.set('schema:membership', 2)
+        self.schema = 2
 
 
 class RedisStorage(Storage, metaclass=ABCMeta):
     def __init__(self):
-        if not r.exists(self.prefix):
-            rj.jsonset(self.prefix, Path.rootPath(), [])
-            self.first_load = True
-        else:
+        self.names_key = 'names:' + self.prefix
+        self.order_key = 'order:' + self.prefix
+        self.schema_key = 'schema:' + self.prefix
+        self._index: Optional[NameIndex] = None
+        self._index_version = 0
+        if rj.exists(self.schema_key):
+            self.first_load = False
+        elif rj.exists(self.prefix):
+            self._migrate()
             self.first_load = False
+        else:
+            rj.set(self.schema_key, 2)
+            self.first_load = True
 
     @property
     @abstractmethod
     def prefix(self) -> str:
         pass
 
+    @property
+    def reverse_order(self) -> bool:
+        return False
+
     @abstractmethod
     def get_item_type(self) -> Type:
         pass
 
+    def _score(self, item: Item) -> str:
+        return ''
+
+    def _migrate(self):
+        names = rj.jsonget(self.prefix, Path.rootPath())
+        pipe = rj.pipeline(transaction=False)
+        for name in names:
+            pipe.jsonget(self.prefix + name, Path.rootPath())
+        items = [self._load(data) for data in pipe.execute()]
+        pipe = rj.pipeline()
+        pipe.delete(self.names_key, self.order_key)
+        for idx, (name, item) in enumerate(zip(names, items)):
+            if item is None:
+                continue
+            score = self._score(item)
+            pipe.sadd(self.names_key, name)
+            pipe.zadd(self.order_key, {name: idx if score == '' else float(score)})
+        pipe.delete(self.prefix)
+        pipe.set(self.schema_key, 2)
+        publish_change(pipe, self.names_key)
+        pipe.execute()
+
     def get(self, name: str) -> Optional[Item]:
-        data = rj.jsonget(self.prefix + name, Path.rootPath())
+        key = self.prefix + name
+        hit, item, generation = cache.get(key)
+        if hit:
+            return item
+        item = self._load(rj.jsonget(key, Path.rootPath()))
+        if item is not None:
+            cache.put(key, item, generation)
+        return item
+
+    def get_many(self, names: List[str]) -> List[Optional[Item]]:
+        items: List[Optional[Item]] = [None] * len(names)
+        missing = []
+        for idx, name in enumerate(names):
+            hit, item, generation = cache.get(self.prefix + name)
+            if hit:
+                items[idx] = item
+            else:
+                missing.append((idx, name, generation))
+        if len(missing) > 0:
+            pipe = rj.pipeline(transaction=False)
+            for idx, name, generation in missing:
+                pipe.jsonget(self.prefix + name, Path.rootPath())
+            for (idx, name, generation), data in zip(missing, pipe.execute()):
+                item = items[idx] = self._load(data)
+                if item is not None:
+                    cache.put(self.prefix + name, item, generation)
+        return items
+
+    def _load(self, data) -> Optional[Item]:
         if data is None:
             return None
-        data = deserialize(data, self.get_item_type())
-        for msg in data.msg:
-            msg.text = msg.text.encode('latin1').decode('utf-8')
-        if self.prefix == 'p-':
-            for i in range(len(data.list)):
-                data.list[i] = data.list[i].encode('latin1').decode('utf-8')
-        return data
+        return deserialize(data, self.get_item_type())
+
+    def _set_item(self, name: str, item: Item, only_if_absent: bool) -> bool:
+        invalidate(self.prefix + name)
+        rst = bool(scripts['set_item'](
+            keys=[self.names_key, self.order_key, self.prefix + name],
+            args=[name, json.dumps(serialize(item)), self._score(item), int(only_if_absent)]
+        ))
+        if self._index is not None:
+            self._index.add(name)
+        return rst
 
     def set(self, name: str, item: Item):
-        if not self.contains(name):
-            rj.jsonarrappend(self.prefix, Path.rootPath(), name)
-        rj.jsonset(self.prefix + name, Path.rootPath(), serialize(item))
+        self._set_item(name, item, False)
 
     def contains(self, name: str) -> bool:
-        return bool(rj.exists(self.prefix + name)) and name in self.get_all_names()
+        return bool(rj.sismember(self.names_key, name))
 
     def add_item(self, name: str, item: Item) -> bool:
-        if self.contains(name):
-            return False
-        self.set(name, item)
-        return True
+        return self._set_item(name, item, True)
 
     def pop_item(self, name: str) -> Item:
-        rj.jsonarrpop(self.prefix, Path.rootPath(), rj.jsonarrindex(self.prefix, Path.rootPath(), name))
-        rst = self.get(name)
-        rj.jsondel(self.prefix + name, Path.rootPath())
-        return rst
+        invalidate(self.prefix + name)
+        if self._index is not None:
+            self._index.remove(name)
+        data = scripts['pop_item'](keys=[self.names_key, self.order_key, self.prefix + name], args=[name])
+        return self._load(None if data is None else json.loads(data))
 
     def for_each(self, callback: Callable):
-        for name in self.get_all_names():
-            item = self.get(name)
+        names = self.get_all_names()
+        pipe = rj.pipeline(transaction=False)
+        for name in names:
+            pipe.jsonget(self.prefix + name, Path.rootPath())
+        items = [self._load(data) for data in pipe.execute()]
+        pipe = rj.pipeline(transaction=False)
+        for name, item in zip(names, items):
+            if item is None:
+                continue
             callback(name, item)
-            self.set(name, item)
+            pipe.jsonset(self.prefix + name, Path.rootPath(), serialize(item))
+            publish_change(pipe, self.prefix + name)
+        pipe.execute()
 
     def change_perm(self, name: str, level: int):
-        rj.jsonset(self.prefix + name, Path('.perm'), level)
+        pipe = rj.pipeline(transaction=False)
+        pipe.jsonset(self.prefix + name, Path('.perm'), level)
+        publish_change(pipe, self.prefix + name)
+        pipe.execute()
 
     def change_color(self, name: str, color: str):
-        rj.jsonset(self.prefix + name, Path('.color'), color)
+        pipe = rj.pipeline(transaction=False)
+        pipe.jsonset(self.prefix + name, Path('.color'), color)
+        publish_change(pipe, self.prefix + name)
+        pipe.execute()
 
     def join(self, item, value) -> bool:
-        lst = rj.jsonget(self.prefix + item, Path('.list'))
-        for i in range(len(lst)):
-            lst[i] = lst[i].encode('latin1').decode('utf-8')
-        idx = bisect.bisect_left(lst, value)
-        if not (idx < len(lst) and lst[idx] == value):
-            bisect.insort_left(lst, value)
-            rj.jsonset(self.prefix + item, Path('.list'), lst)
-            return True
-        return False
+        invalidate(self.prefix + item)
+        return bool(scripts['join_leave'](keys=[self.prefix + item], args=[json.dumps(value), 'join']))
 
     def leave(self, item, value) -> bool:
-        lst = rj.jsonget(self.prefix + item, Path('.list'))
-        for i in range(len(lst)):
-            lst[i] = lst[i].encode('latin1').decode('utf-8')
-        idx = bisect.bisect_left(lst, value)
-        if idx < len(lst) and lst[idx] == value:
-            lst.pop(bisect.bisect_left(lst, value))
-            rj.jsonset(self.prefix + item, Path('.list'), lst)
-            return True
-        return False
+        invalidate(self.prefix + item)
+        return bool(scripts['join_leave'](keys=[self.prefix + item], args=[json.dumps(value), 'leave']))
 
     def add_msg(self, item, sender, text: str):
         msg = Msg(time=time.time(), sender=sender, text=text)
-        rj.jsonarrappend(self.prefix + item, Path('.msg'), serialize(msg))
+        pipe = rj.pipeline(transaction=False)
+        pipe.jsonarrappend(self.prefix + item, Path('.msg'), serialize(msg))
+        publish_change(pipe, self.prefix + item)
+        pipe.execute()
 
     def edit_msg(self, item, line, text):
-        rj.jsonset(self.prefix + item, Path(f'.msg[{line}].text'), text)
+        pipe = rj.pipeline(transaction=False)
+        pipe.jsonset(self.prefix + item, Path(f'.msg[{line}].text'), text)
+        publish_change(pipe, self.prefix + item)
+        pipe.execute()
 
     def del_msg(self, item, line):
-        rj.jsonarrpop(self.prefix + item, Path(f'.msg'), line)
+        pipe = rj.pipeline(transaction=False)
+        pipe.jsonarrpop(self.prefix + item, Path(f'.msg'), line)
+        publish_change(pipe, self.prefix + item)
+        pipe.execute()
+
+    def trim_msgs(self, item, count: int, last_time: float) -> bool:
+        invalidate(self.prefix + item)
+        return bool(scripts['trim_msgs'](keys=[self.prefix + item], args=[count, repr(last_time)]))
 
     def get_all_names(self) -> List[str]:
-        data = rj.jsonget(self.prefix, Path.rootPath())
-        for i in range(len(data)):
-            data[i] = data[i].encode('latin1').decode('utf-8')
-        return data
+        return self.get_range(0)
+
+    def get_range(self, start: int, stop: Optional[int] = None) -> List[str]:
+        end = -1 if stop is None else stop - 1
+        if end < start and stop is not None:
+            return []
+        if self.reverse_order:
+            return rj.zrevrange(self.order_key, start, end)
+        return rj.zrange(self.order_key, start, end)
+
+    def count(self) -> int:
+        return rj.zcard(self.order_key)
+
+    def get_version(self, name: str) -> int:
+        return versions.get(self.prefix + name)
+
+    def search(self, keyword: str) -> List[str]:
+        # the names key is published whenever a name is added or removed, here or on another server
+        version = versions.get(self.names_key)
+        if self._index is None or self._index_version != version:
+            self._index_version = version
+            self._index = NameIndex(rj.smembers(self.names_key))
+        return self._index.search(keyword)
 
     def ordered_items(self, item_list: List[str]) -> List[str]:
-        rst: List[str] = []
-        for name in self.get_all_names():
-            if name in item_list:
-                rst.append(name)
-        return rst
+        pipe = rj.pipeline(transaction=False)
+        for name in item_list:
+            pipe.zscore(self.order_key, name)
+        scored = [(score, name) for name, score in zip(item_list, pipe.execute()) if score is not None]
+        scored.sort(reverse=self.reverse_order)
+        return [name for score, name in scored]
 
     def place_item(self, name, pos):
-        if not self.contains(name):
-            raise Exception('No such item')
-        rj.jsonarrpop(self.prefix, Path.rootPath(), rj.jsonarrindex(self.prefix, Path.rootPath(), name))
-        rj.jsonarrinsert(self.prefix, Path.rootPath(), pos, name)
+        scripts['place_item'](keys=[self.names_key, self.order_key], args=[name, pos])
+
+    def rank(self, name: str) -> Optional[int]:
+        if self.reverse_order:
+            return rj.zrevrank(self.order_key, name)
+        return rj.zrank(self.order_key, name)
+
+    def close(self):
+        close_redis()
 
 
 class RedisGroupStorage(GroupStorage, RedisStorage):
@@ -173,18 +631,33 @@ class RedisPlayerStorage(PlayerStorage, RedisStorage):
     def prefix(self) -> str:
         return 'p-'
 
+    @property
+    def reverse_order(self) -> bool:
+        return True
+
     def get_item_type(self) -> Type:
         return Player
 
-    def add_item(self, name: str, item: Item) -> bool:
-        if self.contains(name):
-            return False
-        if not self.contains(name):
-            rj.jsonarrinsert(self.prefix, Path.rootPath(), 0, name)
-        rj.jsonset(self.prefix + name, Path.rootPath(), serialize(item))
-        return True
+    def _score(self, item: Player) -> str:
+        return repr(item.latest_online_time)
 
     def update_latest_online_time(self, name):
-        rj.jsonset(self.prefix + name, Path('.latest_online_time'), time.time())
-        player = rj.jsonarrpop(self.prefix, Path.rootPath(), rj.jsonarrindex(self.prefix, Path.rootPath(), name))
-        rj.jsonarrinsert(self.prefix, Path.rootPath(), 0, player)
+        invalidate(self.prefix + name)
+        scripts['touch_item'](keys=[self.order_key, self.prefix + name], args=[name, time.time()])
+
+    def update_latest_online_times(self, times: Dict[str, float]):
+        pipe = rj.pipeline(transaction=False)
+        for name, time_t in times.items():
+            invalidate(self.prefix + name)
+            scripts['touch_item'](keys=[self.order_key, self.prefix + name], args=[name, time_t], client=pipe)
+        pipe.execute()
+
+    def get_latest_online_times(self) -> Dict[str, float]:
+        return dict(rj.zrevrange(self.order_key, 0, -1, withscores=True))
+
+    def update_last_checked(self, times: Dict[str, float]):
+        pipe = rj.pipeline(transaction=False)
+        for name, time_t in times.items():
+            invalidate(self.prefix + name)
+            scripts['set_field'](keys=[self.prefix + name], args=['.last_checked', repr(time_t)], client=pipe)
+        pipe.execute()
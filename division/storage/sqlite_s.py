@@ -0,0 +1,474 @@
+import sqlite3
+import time
+from threading import RLock
+from typing import List, Optional, Type, Callable, Dict, Tuple
+from collections import OrderedDict, defaultdict
+from abc import ABCMeta, abstractmethod
+
+from mcdreforged.api.all import *
+
+from division.storage.cache import VersionTable
+from division.storage.index import NameIndex
+from division.storage.storage import Storage, GroupStorage, PlayerStorage, OtherStorage, MembershipStorage, Item, \
+    Group, Player, Msg
+from division.constants import GROUP_OF_ALL
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    perm INTEGER NOT NULL,
+    color TEXT NOT NULL,
+    ip TEXT,
+    latest_online_time REAL,
+    position REAL NOT NULL,
+    last_checked REAL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS items_position ON items (kind, position);
+CREATE TABLE IF NOT EXISTS members (
+    kind TEXT NOT NULL,
+    item TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (kind, item, value)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS members_value ON members (kind, value);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    item TEXT NOT NULL,
+    time REAL NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_item ON messages (kind, item, id);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (kind, item, time);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender);
+"""
+MAX_VARIABLES = 500
+
+conn: Optional[sqlite3.Connection] = None
+lock = RLock()
+
+
+def init_sqlite(file_path: str):
+    global conn
+    with lock:
+        close_sqlite()
+        # statements are plain strings with parameters, so the connection's statement cache prepares each once
+        conn = sqlite3.connect(file_path, check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.executescript(SCHEMA)
+        if 'last_checked' not in [row[1] for row in conn.execute('PRAGMA table_info(items)')]:
+            conn.execute('ALTER TABLE items ADD COLUMN last_checked REAL')  # files made before the column existed
+
+
+def close_sqlite():
+    global conn
+    with lock:
+        if conn is not None:
+            conn.execute('PRAGMA optimize')
+            conn.close()
+            conn = None
+
+
+class SqliteOtherStorage(OtherStorage):
+    # the group list of All is the membership of All itself, which group_storage.join() already wrote
+    def get_group_for_all(self) -> List[str]:
+        with lock:
+            return [name for name, in conn.execute(
+                'SELECT m.item FROM members m JOIN items i ON i.kind = m.kind AND i.name = m.item '
+                'WHERE m.kind = ? AND m.value = ? ORDER BY i.position', ('g', GROUP_OF_ALL))]
+
+    def add_group_for_all(self, name):
+        pass
+
+    def remove_group_for_all(self, name):
+        pass
+
+
+class SqliteMembershipStorage(MembershipStorage):
+    # group rows of the members table are the relation, members_value indexes them by player
+    def __init__(self, group_storage: Storage):
+        self.group_storage = group_storage
+
+    def add(self, group: str, player: str) -> bool:
+        return self.group_storage.join(group, player)
+
+    def remove(self, group: str, player: str) -> bool:
+        return self.group_storage.leave(group, player)
+
+    def groups_of(self, player: str) -> List[str]:
+        with lock:
+            return [name for name, in conn.execute(
+                'SELECT item FROM members WHERE kind = ? AND value = ? ORDER BY item', ('g', player))]
+
+    def remove_group(self, group: str):
+        pass  # the rows are deleted together with the group
+
+    def lists_migrated(self) -> bool:
+        with lock:
+            return conn.execute('SELECT 1 FROM meta WHERE key = ?', ('schema:membership',)).fetchone() is not None
+
+    def mark_lists_migrated(self):
+        with lock, conn:
+            conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('schema:membership', '1'))
+
+
+class SqliteStorage(Storage, metaclass=ABCMeta):
+    def __init__(self):
+        self._versions = VersionTable()
+        with lock:
+            # the schema row is written by import_items(), so a failed first import is tried again on the next start
+            self.first_load = conn.execute('SELECT 1 FROM meta WHERE key = ?', (self._schema_key,)).fetchone() is None
+        self._index = NameIndex(self.get_all_names())
+
+    @property
+    @abstractmethod
+    def kind(self) -> str:
+        pass
+
+    @property
+    def _schema_key(self) -> str:
+        return 'schema:' + self.kind
+
+    @property
+    def reverse_order(self) -> bool:
+        return False
+
+    @abstractmethod
+    def get_item_type(self) -> Type:
+        pass
+
+    def _position(self, item: Item) -> Optional[float]:
+        return None  # appended
+
+    def _build(self, row: tuple, members: List[str], msgs: List[tuple]) -> Item:
+        perm, color, ip, latest_online_time, last_checked = row
+        item = self.get_item_type()(perm=perm, color=color, list=members,
+                                    msg=[Msg(time=t, sender=sender, text=text) for t, sender, text in msgs])
+        if isinstance(item, Player):
+            item.ip, item.latest_online_time, item.last_checked = ip, latest_online_time, last_checked or 0
+        return item
+
+    def _insert(self, name: str, item: Item, position: float):
+        conn.execute('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+            self.kind, name, item.perm, item.color,
+            getattr(item, 'ip', None), getattr(item, 'latest_online_time', None), position,
+            getattr(item, 'last_checked', None)
+        ))
+        self._insert_children(name, item)
+
+    def _insert_children(self, name: str, item: Item):
+        conn.executemany('INSERT OR IGNORE INTO members VALUES (?, ?, ?)',
+                         [(self.kind, name, value) for value in item.list])
+        conn.executemany('INSERT INTO messages (kind, item, time, sender, text) VALUES (?, ?, ?, ?, ?)',
+                         [(self.kind, name, msg.time, msg.sender, msg.text) for msg in item.msg])
+
+    def _delete_children(self, name: str):
+        conn.execute('DELETE FROM members WHERE kind = ? AND item = ?', (self.kind, name))
+        conn.execute('DELETE FROM messages WHERE kind = ? AND item = ?', (self.kind, name))
+
+    def _next_position(self) -> float:
+        return conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM items WHERE kind = ?',
+                            (self.kind,)).fetchone()[0]
+
+    def _check_exists(self, name: str):
+        if conn.execute('SELECT 1 FROM items WHERE kind = ? AND name = ?', (self.kind, name)).fetchone() is None:
+            raise Exception('No such item')
+
+    def _order_by(self) -> str:
+        return 'ORDER BY position DESC, name' if self.reverse_order else 'ORDER BY position, name'
+
+    def get(self, name: str) -> Optional[Item]:
+        with lock:
+            row = conn.execute('SELECT perm, color, ip, latest_online_time, last_checked FROM items '
+                               'WHERE kind = ? AND name = ?', (self.kind, name)).fetchone()
+            if row is None:
+                return None
+            members = [value for value, in conn.execute(
+                'SELECT value FROM members WHERE kind = ? AND item = ? ORDER BY value', (self.kind, name))]
+            msgs = conn.execute('SELECT time, sender, text FROM messages WHERE kind = ? AND item = ? ORDER BY id',
+                                (self.kind, name)).fetchall()
+        return self._build(row, members, msgs)
+
+    def get_many(self, names: List[str]) -> List[Optional[Item]]:
+        with lock:
+            return [self.get(name) for name in names]
+
+    def get_msgs_after(self, names: List[str], time_t: float) -> List[Optional[Tuple[int, List[Msg]]]]:
+        rst = []
+        with lock:
+            for name in names:
+                if not self.contains(name):
+                    rst.append(None)
+                    continue
+                start = conn.execute('SELECT COUNT(*) FROM messages WHERE kind = ? AND item = ? AND time <= ?',
+                                     (self.kind, name, time_t)).fetchone()[0]
+                rst.append((start, [Msg(time=t, sender=sender, text=text) for t, sender, text in conn.execute(
+                    'SELECT time, sender, text FROM messages WHERE kind = ? AND item = ? AND time > ? ORDER BY id',
+                    (self.kind, name, time_t))]))
+        return rst
+
+    def contains(self, name: str) -> bool:
+        with lock:
+            return conn.execute('SELECT 1 FROM items WHERE kind = ? AND name = ?',
+                                (self.kind, name)).fetchone() is not None
+
+    def add_item(self, name: str, item: Item) -> bool:
+        with lock, conn:
+            if self.contains(name):
+                return False
+            position = self._position(item)
+            self._insert(name, item, self._next_position() if position is None else position)
+        self._index.add(name)
+        self._versions.bump(name)
+        return True
+
+    def import_items(self, items: 'OrderedDict[str, Item]'):
+        with lock, conn:
+            start = self._next_position()
+            for idx, (name, item) in enumerate(items.items()):
+                position = self._position(item)
+                self._insert(name, item, start + idx if position is None else position)
+            conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', (self._schema_key, '1'))
+        self.first_load = False
+        for name in items:
+            self._index.add(name)
+        self._versions.bump_all()
+
+    def pop_item(self, name: str) -> Item:
+        with lock, conn:
+            item = self.get(name)
+            if item is not None:
+                conn.execute('DELETE FROM items WHERE kind = ? AND name = ?', (self.kind, name))
+                self._delete_children(name)
+        self._index.remove(name)
+        self._versions.bump(name)
+        return item
+
+    def _load_all(self) -> 'OrderedDict[str, Item]':
+        members: Dict[str, List[str]] = defaultdict(list)
+        msgs: Dict[str, List[tuple]] = defaultdict(list)
+        with lock:
+            rows = conn.execute(f'SELECT name, perm, color, ip, latest_online_time, last_checked FROM items '
+                                f'WHERE kind = ? {self._order_by()}', (self.kind,)).fetchall()
+            for item, value in conn.execute('SELECT item, value FROM members WHERE kind = ? ORDER BY item, value',
+                                            (self.kind,)):
+                members[item].append(value)
+            for item, t, sender, text in conn.execute(
+                    'SELECT item, time, sender, text FROM messages WHERE kind = ? ORDER BY id', (self.kind,)):
+                msgs[item].append((t, sender, text))
+        return OrderedDict((row[0], self._build(row[1:], members[row[0]], msgs[row[0]])) for row in rows)
+
+    def for_each(self, callback: Callable):
+        with lock, conn:
+            for name, item in self._load_all().items():
+                before = serialize(item)
+                callback(name, item)
+                if serialize(item) == before:
+                    continue
+                conn.execute('UPDATE items SET perm = ?, color = ?, ip = ?, latest_online_time = ?, '
+                             'position = COALESCE(?, position), last_checked = ? WHERE kind = ? AND name = ?', (
+                                 item.perm, item.color, getattr(item, 'ip', None),
+                                 getattr(item, 'latest_online_time', None), self._position(item),
+                                 getattr(item, 'last_checked', None), self.kind, name
+                             ))
+                self._delete_children(name)
+                self._insert_children(name, item)
+        self._versions.bump_all()
+
+    def change_perm(self, name: str, level: int):
+        with lock, conn:
+            if conn.execute('UPDATE items SET perm = ? WHERE kind = ? AND name = ?',
+                            (level, self.kind, name)).rowcount == 0:
+                raise Exception('No such item')
+        self._versions.bump(name)
+
+    def change_color(self, name: str, color: str):
+        with lock, conn:
+            if conn.execute('UPDATE items SET color = ? WHERE kind = ? AND name = ?',
+                            (color, self.kind, name)).rowcount == 0:
+                raise Exception('No such item')
+        self._versions.bump(name)
+        return True
+
+    def join(self, item, value) -> bool:
+        with lock, conn:
+            self._check_exists(item)
+            r = conn.execute('INSERT OR IGNORE INTO members VALUES (?, ?, ?)', (self.kind, item, value)).rowcount == 1
+        self._versions.bump(item)
+        return r
+
+    def leave(self, item, value) -> bool:
+        with lock, conn:
+            r = conn.execute('DELETE FROM members WHERE kind = ? AND item = ? AND value = ?',
+                             (self.kind, item, value)).rowcount == 1
+        self._versions.bump(item)
+        return r
+
+    def add_msg(self, item, sender, text):
+        with lock, conn:
+            self._check_exists(item)
+            conn.execute('INSERT INTO messages (kind, item, time, sender, text) VALUES (?, ?, ?, ?, ?)',
+                         (self.kind, item, time.time(), sender, text))
+        self._versions.bump(item)
+
+    def _msg_id(self, item, line: int) -> int:
+        # lines are list indexes, so negative ones count from the end like the other storages
+        order = 'ORDER BY id' if line >= 0 else 'ORDER BY id DESC'
+        row = conn.execute(f'SELECT id FROM messages WHERE kind = ? AND item = ? {order} LIMIT 1 OFFSET ?',
+                           (self.kind, item, line if line >= 0 else -line - 1)).fetchone()
+        if row is None:
+            raise IndexError('list index out of range')
+        return row[0]
+
+    def edit_msg(self, item, line, text):
+        with lock, conn:
+            conn.execute('UPDATE messages SET text = ? WHERE id = ?', (text, self._msg_id(item, line)))
+        self._versions.bump(item)
+
+    def del_msg(self, item, line):
+        with lock, conn:
+            conn.execute('DELETE FROM messages WHERE id = ?', (self._msg_id(item, line),))
+        self._versions.bump(item)
+
+    def trim_msgs(self, item, count: int, last_time: float) -> bool:
+        with lock, conn:
+            row = conn.execute('SELECT id, time FROM messages WHERE kind = ? AND item = ? ORDER BY id LIMIT 1 OFFSET ?',
+                               (self.kind, item, count - 1)).fetchone()
+            if count <= 0 or row is None or row[1] != last_time:
+                return False
+            conn.execute('DELETE FROM messages WHERE kind = ? AND item = ? AND id <= ?', (self.kind, item, row[0]))
+        self._versions.bump(item)
+        return True
+
+    def get_all_names(self) -> List[str]:
+        return self.get_range(0)
+
+    def get_range(self, start: int, stop: Optional[int] = None) -> List[str]:
+        limit = -1 if stop is None else max(stop - start, 0)
+        with lock:
+            return [name for name, in conn.execute(
+                f'SELECT name FROM items WHERE kind = ? {self._order_by()} LIMIT ? OFFSET ?',
+                (self.kind, limit, start))]
+
+    def count(self) -> int:
+        with lock:
+            return conn.execute('SELECT COUNT(*) FROM items WHERE kind = ?', (self.kind,)).fetchone()[0]
+
+    def search(self, keyword: str) -> List[str]:
+        return self._index.search(keyword)
+
+    def get_version(self, name: str) -> int:
+        return self._versions.get(name)
+
+    def ordered_items(self, item_list: List[str]) -> List[str]:
+        scored = []
+        with lock:
+            for i in range(0, len(item_list), MAX_VARIABLES):
+                chunk = item_list[i:i + MAX_VARIABLES]
+                scored += conn.execute(
+                    f'SELECT position, name FROM items WHERE kind = ? AND name IN ({",".join("?" * len(chunk))})',
+                    (self.kind, *chunk)).fetchall()
+        if self.reverse_order:
+            scored.sort(key=lambda x: (-x[0], x[1]))
+        else:
+            scored.sort()
+        return [name for position, name in scored]
+
+    def place_item(self, name, pos):
+        with lock, conn:
+            if not self.contains(name) or pos >= self.count():
+                raise IndexError
+
+            def neighbour(idx: int) -> Optional[float]:
+                if idx < 0:
+                    return None
+                row = conn.execute('SELECT position FROM items WHERE kind = ? AND name != ? '
+                                   'ORDER BY position, name LIMIT 1 OFFSET ?', (self.kind, name, idx)).fetchone()
+                return None if row is None else row[0]
+
+            prev, next_ = neighbour(pos - 1), neighbour(pos)
+            if prev is not None and next_ is not None and next_ - prev < 1e-6:  # no room left, renumber
+                names = conn.execute('SELECT name FROM items WHERE kind = ? ORDER BY position, name',
+                                     (self.kind,)).fetchall()
+                conn.executemany('UPDATE items SET position = ? WHERE kind = ? AND name = ?',
+                                 [(idx, self.kind, n) for idx, (n,) in enumerate(names)])
+                prev, next_ = neighbour(pos - 1), neighbour(pos)
+            if prev is not None and next_ is not None:
+                position = (prev + next_) / 2
+            elif prev is not None:
+                position = prev + 1
+            elif next_ is not None:
+                position = next_ - 1
+            else:
+                position = 0
+            conn.execute('UPDATE items SET position = ? WHERE kind = ? AND name = ?', (position, self.kind, name))
+        self._versions.bump(name)
+
+    def rank(self, name: str) -> Optional[int]:
+        with lock:
+            row = conn.execute('SELECT position FROM items WHERE kind = ? AND name = ?', (self.kind, name)).fetchone()
+            if row is None:
+                return None
+            before = '>' if self.reverse_order else '<'
+            return conn.execute(f'SELECT COUNT(*) FROM items WHERE kind = ? AND (position {before} ? OR '
+                                f'(position = ? AND name < ?))', (self.kind, row[0], row[0], name)).fetchone()[0]
+
+    def close(self):
+        close_sqlite()
+
+
+class SqliteGroupStorage(GroupStorage, SqliteStorage):
+
+    @property
+    def kind(self) -> str:
+        return 'g'
+
+    def get_item_type(self) -> Type:
+        return Group
+
+
+class SqlitePlayerStorage(PlayerStorage, SqliteStorage):
+
+    @property
+    def kind(self) -> str:
+        return 'p'
+
+    @property
+    def reverse_order(self) -> bool:
+        return True
+
+    def get_item_type(self) -> Type:
+        return Player
+
+    def _position(self, item: Player) -> Optional[float]:
+        return item.latest_online_time
+
+    def update_latest_online_times(self, times: Dict[str, float]):
+        with lock, conn:
+            conn.executemany('UPDATE items SET latest_online_time = ?, position = ? WHERE kind = ? AND name = ?',
+                             [(time_t, time_t, self.kind, name) for name, time_t in times.items()])
+        for name in times:
+            self._versions.bump(name)
+
+    def get_latest_online_times(self) -> Dict[str, float]:
+        with lock:
+            return dict(conn.execute(f'SELECT name, latest_online_time FROM items WHERE kind = ? {self._order_by()}',
+                                     (self.kind,)))
+
+    def update_last_checked(self, times: Dict[str, float]):
+        with lock, conn:
+            conn.executemany('UPDATE items SET last_checked = ? WHERE kind = ? AND name = ?',
+                             [(time_t, self.kind, name) for name, time_t in times.items()])
+
+    def update_latest_online_time(self, name):
+        now = time.time()
+        with lock, conn:
+            conn.execute('UPDATE items SET latest_online_time = ?, position = ? WHERE kind = ? AND name = ?',
+                         (now, now, self.kind, name))
+        self._versions.bump(name)
@@ -1,5 +1,6 @@
-from typing import List, Optional, Type, Callable
+from typing import List, Optional, Type, Callable, Dict, Tuple
 import bisect
+import copy
 from abc import ABCMeta, abstractmethod
 import time
 
@@ -29,19 +30,31 @@ class Item(Serializable, metaclass=ABCMeta):
             cl = config.default_color
         return cl
 
-    def add_msg(self, sender: str, text: str):
-        self.msg.append(Msg(time=time.time(), sender=sender, text=text))
+    def add_msg(self, sender: str, text: str, time_t: float = None):
+        self.msg.append(Msg(time=time.time() if time_t is None else time_t, sender=sender, text=text))
 
     def del_msg(self, idx: int):
         self.msg.pop(idx)
 
     def edit_msg(self, idx: int, text: str):
-        self.msg[idx].text = text
+        old = self.msg[idx]
+        self.msg[idx] = Msg(time=old.time, sender=old.sender, text=text)
 
     def for_each_msg(self, callback: Callable):
         for m in self.msg:
             callback(m)
 
+    def msgs_after(self, time_t: float) -> int:
+        # messages are appended as they are sent, so the list is already ordered by time
+        return bisect.bisect_right(self.msg, time_t, key=lambda m: m.time)
+
+    def snapshot(self) -> 'Item':
+        # messages are replaced rather than edited in place, so copying the lists detaches the item
+        item = copy.copy(self)
+        item.msg = list(self.msg)
+        item.list = list(self.list)
+        return item
+
     def in_list(self, value: str):
         idx = bisect.bisect_left(self.list, value)
         return idx < len(self.list) and self.list[idx] == value
@@ -66,9 +79,10 @@ class Group(Item):
 class Player(Item):
     ip: str
     latest_online_time: float
+    last_checked: float = 0
 
-    def update_latest_online_time(self):
-        self.latest_online_time = time.time()
+    def update_latest_online_time(self, time_t: float = None):
+        self.latest_online_time = time.time() if time_t is None else time_t
 
 
 class OtherStorage(metaclass=ABCMeta):
@@ -85,12 +99,52 @@ class OtherStorage(metaclass=ABCMeta):
         pass
 
 
+class MembershipStorage(metaclass=ABCMeta):
+    # the group lists are the single record of membership, this also indexes them by player
+    @abstractmethod
+    def add(self, group: str, player: str) -> bool:
+        pass
+
+    @abstractmethod
+    def remove(self, group: str, player: str) -> bool:
+        pass
+
+    @abstractmethod
+    def groups_of(self, player: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def remove_group(self, group: str):
+        pass
+
+    def lists_migrated(self) -> bool:
+        # whether the lists players used to keep were folded into the groups, in-memory storages just scan again
+        return False
+
+    def mark_lists_migrated(self):
+        pass
+
+
 class Storage(metaclass=ABCMeta):
 
     @abstractmethod
     def get(self, name: str) -> Optional[Item]:
         pass
 
+    def get_many(self, names: List[str]) -> List[Optional[Item]]:
+        return [self.get(name) for name in names]
+
+    def get_msgs_after(self, names: List[str], time_t: float) -> List[Optional[Tuple[int, List[Msg]]]]:
+        # (index of the first message sent after time_t, those messages) of each item
+        rst = []
+        for item in self.get_many(names):
+            if item is None:
+                rst.append(None)
+            else:
+                start = item.msgs_after(time_t)
+                rst.append((start, item.msg[start:]))
+        return rst
+
     @abstractmethod
     def contains(self, name: str) -> bool:
         pass
@@ -135,10 +189,31 @@ class Storage(metaclass=ABCMeta):
     def del_msg(self, item, line):
         pass
 
+    @abstractmethod
+    def trim_msgs(self, item, count: int, last_time: float) -> bool:
+        # drops the first count messages, unless the last of them isn't sent at last_time any more
+        pass
+
     @abstractmethod
     def get_all_names(self) -> List[str]:
         pass
 
+    @abstractmethod
+    def get_range(self, start: int, stop: Optional[int] = None) -> List[str]:
+        pass
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    @abstractmethod
+    def search(self, keyword: str) -> List[str]:
+        pass
+
+    @abstractmethod
+    def get_version(self, name: str) -> int:
+        pass
+
     @abstractmethod
     def ordered_items(self, item_list: List[str]) -> List[str]:
         pass
@@ -147,6 +222,13 @@ class Storage(metaclass=ABCMeta):
     def place_item(self, name, pos):
         pass
 
+    @abstractmethod
+    def rank(self, name: str) -> Optional[int]:
+        pass
+
+    def close(self):
+        pass
+
 
 class GroupStorage(metaclass=ABCMeta):
     pass
@@ -157,25 +239,27 @@ class PlayerStorage(metaclass=ABCMeta):
     def update_latest_online_time(self, name):
         pass
 
+    @abstractmethod
+    def update_latest_online_times(self, times: Dict[str, float]):
+        pass
+
+    @abstractmethod
+    def get_latest_online_times(self) -> Dict[str, float]:
+        pass
+
+    @abstractmethod
+    def update_last_checked(self, times: Dict[str, float]):
+        pass
+
 
 def build_player(ip) -> Player:
     from division.entry import config
-    try:
-        from division.entry import other_storage
-        player = Player(
-            perm=-1,
-            color=config.default_color,
-            ip=ip,
-            latest_online_time=time.time(),
-            list=other_storage.get_group_for_all()
-        )
-    except Exception as e:
-        player = Player(
-            perm=-1,
-            color=config.default_color,
-            ip=ip,
-            latest_online_time=time.time()
-        )
+    player = Player(
+        perm=-1,
+        color=config.default_color,
+        ip=ip,
+        latest_online_time=time.time()
+    )
     if config.msg_for_new_player != '':
         player.add_msg(config.default_sender, config.msg_for_new_player)
     return player
@@ -185,7 +269,23 @@ def build_other_storage(mode: str) -> OtherStorage:
     from division.entry import group_storage
     from division.storage.direct import DirectOtherStorage
     from division.storage.redis_s import RedisOtherStorage
+    from division.storage.sqlite_s import SqliteOtherStorage
     if mode == 'direct':
         return DirectOtherStorage(group_storage)
     elif mode == 'redis':
         return RedisOtherStorage()
+    elif mode == 'sqlite':
+        return SqliteOtherStorage()
+
+
+def build_membership_storage(mode: str) -> MembershipStorage:
+    from division.entry import group_storage
+    from division.storage.direct import DirectMembershipStorage
+    from division.storage.redis_s import RedisMembershipStorage
+    from division.storage.sqlite_s import SqliteMembershipStorage
+    if mode == 'direct':
+        return DirectMembershipStorage(group_storage)
+    elif mode == 'redis':
+        return RedisMembershipStorage(group_storage)
+    elif mode == 'sqlite':
+        return SqliteMembershipStorage(group_storage)
@@ -0,0 +1,31 @@
+import pytest
+
+import division.entry as entry
+from benchmarks.fake_server import FakeServer, FakeOnlinePlayerApi, FakePlayerIpLogger
+
+
+@pytest.fixture
+def server(tmp_path):
+    # the globals of entry that the storages import lazily, without loading the whole plugin
+    server = FakeServer(str(tmp_path), {}, {
+        'online_player_api': FakeOnlinePlayerApi([]),
+        'player_ip_logger': FakePlayerIpLogger({})
+    })
+    server.install()
+    entry.server_inst = server
+    entry.config = entry.Config()
+    return server
+
+
+@pytest.fixture
+def start(tmp_path):
+    # loads the whole plugin on the data folder, on_unload() is left to the test
+    def start(**config) -> FakeServer:
+        server = FakeServer(str(tmp_path), dict({'worker_count': 1}, **config), {
+            'online_player_api': FakeOnlinePlayerApi([]),
+            'player_ip_logger': FakePlayerIpLogger({})
+        })
+        server.install()
+        entry.on_load(server, None)
+        return server
+    return start
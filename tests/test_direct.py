@@ -0,0 +1,75 @@
+import os
+
+import division.entry as entry
+from division.storage.direct import DirectPlayerStorage
+from division.storage.storage import Player
+
+
+def player(*groups: str) -> Player:
+    return Player(perm=-1, color='white', ip='127.0.0.1', latest_online_time=0, list=list(groups))
+
+
+def load(folder: str) -> DirectPlayerStorage:
+    storage = DirectPlayerStorage()
+    storage.load(os.path.join(folder, 'players.json'))
+    return storage
+
+
+def test_for_each_is_written_to_disk(server):
+    storage = load(server.data_folder)
+    storage.add_item('alice', player('g1'))
+    storage.add_msg('alice', 'bob', 'hi')
+    storage.close()
+    storage = load(server.data_folder)  # starts with an empty journal
+    storage.for_each(lambda name, item: item.list.clear())
+    # no close(), as if the server was killed right after
+    reloaded = load(server.data_folder)
+    assert reloaded.get('alice').list == []
+    assert [msg.text for msg in reloaded.get('alice').msg] == ['hi']
+
+
+def test_for_each_without_journal(server):
+    entry.config.journal = False
+    storage = load(server.data_folder)
+    storage.add_item('alice', player('g1'))
+    storage.for_each(lambda name, item: item.list.clear())
+    assert load(server.data_folder).get('alice').list == []
+
+
+def test_for_each_after_a_failed_compaction(server, monkeypatch):
+    storage = load(server.data_folder)
+    storage.add_item('alice', player('g1'))
+    write_snapshot = storage._write_snapshot
+
+    def fail(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(storage, '_write_snapshot', fail)
+    storage._compact()  # leaves the rotated journal behind
+    assert os.path.isfile(storage._journal.old_file_path)
+    monkeypatch.setattr(storage, '_write_snapshot', write_snapshot)
+
+    storage.add_msg('alice', 'bob', 'hi')
+    storage.for_each(lambda name, item: item.list.clear())
+    assert not os.path.isfile(storage._journal.old_file_path)
+    reloaded = load(server.data_folder)
+    assert reloaded.get('alice').list == []
+    assert [msg.text for msg in reloaded.get('alice').msg] == ['hi']
+
+
+def test_failed_compaction_keeps_the_items_of_the_snapshot(server, monkeypatch):
+    storage = load(server.data_folder)
+    storage.add_item('bob', player())
+    storage.close()
+    storage = load(server.data_folder)
+    storage.add_item('alice', player())
+
+    def fail(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(storage, '_write_snapshot', fail)
+    storage._compact()  # bob is in the snapshot, alice only in the rotated journal
+    monkeypatch.undo()
+
+    storage._retire_old_journal()
+    assert sorted(load(server.data_folder).get_all_names()) == ['alice', 'bob']
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import division.entry as entry
+from division.executor import Executor
+
+
+def test_rejected_scheduled_task_is_dropped_quietly(server):
+    executor = Executor()
+    executor.max_pending = 0  # not started, so everything is pending
+    executor.on_reject = entry.print_busy
+    task = executor.task('sweep_msgs')(lambda: None)
+    task()
+    assert executor.rejected == 1
+
+
+def test_join_waits_for_running_tasks(server):
+    executor = Executor()
+    started, finished = threading.Event(), []
+
+    def slow(name):
+        started.set()
+        time.sleep(0.2)
+        finished.append(name)
+
+    executor.start(2, 16)
+    executor.submit('a', slow, 'a')
+    executor.submit('b', slow, 'b')
+    started.wait(1)
+    executor.stop()
+    assert executor.join(5)
+    assert sorted(finished) == ['a', 'b']
+
+
+def test_join_gives_up_after_the_timeout(server):
+    executor = Executor()
+    release = threading.Event()
+    executor.start(1, 16)
+    executor.submit(None, release.wait)
+    executor.stop()
+    assert not executor.join(0.1)
+    release.set()
+    assert executor.join(5)
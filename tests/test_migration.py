@@ -0,0 +1,46 @@
+import json
+import logging
+import os
+
+import division.entry as entry
+from division.storage.sqlite_s import SqliteStorage
+
+
+def write(folder: str, file_name: str, data: dict):
+    with open(os.path.join(folder, file_name), 'w', encoding='utf8') as file:
+        json.dump(data, file)
+
+
+def test_membership_is_migrated_once(tmp_path, start, caplog):
+    folder = str(tmp_path)
+    player = {'perm': -1, 'color': 'white', 'ip': '127.0.0.1', 'latest_online_time': 0}
+    write(folder, 'players.json', {'server': dict(player), 'alice': dict(player, list=['g1'])})
+    write(folder, 'groups.json', {'g1': {'perm': 1, 'color': 'white'}})
+    caplog.set_level(logging.INFO)
+
+    server = start()
+    assert 'alice' in entry.group_storage.get('g1').list
+    assert entry.player_storage.get('alice').list == []
+    entry.on_unload(server)
+    assert sum('Moved the group lists' in record.message for record in caplog.records) == 1
+    with open(os.path.join(folder, 'players.json'), encoding='utf8') as file:
+        assert json.load(file)['alice']['list'] == []
+
+    caplog.clear()
+    server = start()
+    assert 'alice' in entry.group_storage.get('g1').list
+    entry.on_unload(server)
+    assert not any('Moved the group lists' in record.message for record in caplog.records)
+
+
+def test_finished_migration_skips_the_scan(tmp_path, start, monkeypatch):
+    server = start(storage_format='sqlite')
+    assert entry.membership.lists_migrated()
+    entry.on_unload(server)
+
+    scanned = []
+    get_many = SqliteStorage.get_many
+    monkeypatch.setattr(SqliteStorage, 'get_many', lambda self, names: scanned.append(names) or get_many(self, names))
+    server = start(storage_format='sqlite')
+    entry.on_unload(server)
+    assert scanned == []
@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+
+import pytest
+from redis import Redis
+from redis.connection import Connection
+from redis.exceptions import RedisError
+
+from division.storage import redis_s
+from division.storage.storage import Group, Player
+
+# a local redis-server with the RedisJSON module, the database is flushed
+HOST, PORT = os.environ.get('DIVISION_TEST_REDIS', '127.0.0.1:6379').split(':')
+# without a server the tests are skipped, unless one was asked for with DIVISION_TEST_REDIS
+REQUIRED = 'DIVISION_TEST_REDIS' in os.environ
+DB = 15
+
+
+def redis_json_available() -> bool:
+    try:
+        modules = Redis(HOST, int(PORT), db=DB, socket_connect_timeout=1).execute_command('MODULE', 'LIST')
+    except RedisError:
+        return False
+    return any(b'ReJSON' in module for module in modules)  # each module is a list of name, value pairs
+
+
+pytestmark = pytest.mark.skipif(not REQUIRED and not redis_json_available(),
+                                reason='needs a redis-server with RedisJSON, set DIVISION_TEST_REDIS to require one')
+
+
+class RoundTrips:
+    # one send per plain command and one per pipeline, made from the test thread only
+    def __init__(self, monkeypatch):
+        self.count = 0
+        thread = threading.current_thread()
+        send = Connection.send_packed_command
+        counter = self
+
+        def counted(self, command, check_health=True):
+            if threading.current_thread() is thread:
+                counter.count += 1
+            return send(self, command, check_health)
+
+        monkeypatch.setattr(Connection, 'send_packed_command', counted)
+
+    def of(self, func, *args) -> int:
+        self.count = 0
+        func(*args)
+        return self.count
+
+
+@pytest.fixture
+def storages(server):
+    Redis(HOST, int(PORT), db=DB).flushdb()
+    redis_s.init_redis(HOST, int(PORT), DB, None, cache_size=64, health_check_interval=0)
+    for script in redis_s.scripts.values():
+        redis_s.rj.script_load(script.script)
+    players, groups = redis_s.RedisPlayerStorage(), redis_s.RedisGroupStorage()
+    yield players, groups
+    redis_s.close_redis()
+
+
+def player() -> Player:
+    return Player(perm=-1, color='white', ip='127.0.0.1', latest_online_time=time.time())
+
+
+def test_one_round_trip_per_operation(storages, monkeypatch):
+    players, groups = storages
+    trips = RoundTrips(monkeypatch)
+    assert trips.of(players.add_item, 'alice', player()) == 1
+    assert trips.of(groups.add_item, 'g1', Group(perm=1, color='white')) == 1
+    assert trips.of(groups.add_item, 'g2', Group(perm=1, color='white')) == 1
+    assert trips.of(groups.contains, 'g1') == 1
+    assert trips.of(groups.join, 'g1', 'alice') == 1
+    assert trips.of(groups.leave, 'g1', 'alice') == 1
+    assert trips.of(groups.change_perm, 'g1', 2) == 1
+    assert trips.of(groups.change_color, 'g1', 'gold') == 1
+    assert trips.of(groups.add_msg, 'g1', 'alice', 'hello') == 1
+    assert trips.of(groups.add_msg, 'g1', 'alice', '你好') == 1
+    assert trips.of(groups.edit_msg, 'g1', 0, 'hi') == 1
+    assert trips.of(groups.del_msg, 'g1', 1) == 1
+    time.sleep(0.2)  # the writes above come back through pub/sub and drop the cached copy, let them arrive first
+    assert trips.of(groups.get, 'g1') == 1
+    assert trips.of(groups.get, 'g1') == 0  # cached
+    assert trips.of(groups.get_many, ['g1', 'g2', 'missing']) == 1
+    last_time = groups.get('g1').msg[0].time
+    assert trips.of(groups.trim_msgs, 'g1', 1, last_time) == 1
+    assert trips.of(groups.place_item, 'g2', 0) == 1
+    assert trips.of(players.update_latest_online_time, 'alice') == 1
+    assert trips.of(groups.pop_item, 'g2') == 1
+
+    item = groups.get('g1')
+    assert (item.perm, item.color, item.msg) == (2, 'gold', [])
+    assert groups.get_all_names() == ['g1']
+
+
+def test_batches_do_not_grow_with_their_size(storages, monkeypatch):
+    players, groups = storages
+    names = [f'player{i}' for i in range(50)]
+    for name in names:
+        players.add_item(name, player())
+    trips = RoundTrips(monkeypatch)
+    # the scripts are checked with one SCRIPT EXISTS, then the whole batch goes in one pipeline
+    one = trips.of(players.update_latest_online_times, {names[0]: time.time()})
+    assert trips.of(players.update_latest_online_times, {name: time.time() for name in names}) == one <= 2
+    assert trips.of(players.update_last_checked, {name: time.time() for name in names}) == one
+    assert trips.of(players.get_many, names) == 1
+    assert trips.of(players.ordered_items, names) == 1
+
+
+def test_search_sees_names_changed_by_another_server(storages):
+    players, groups = storages
+    groups.add_item('alpha', Group(perm=1, color='white'))
+    assert groups.search('alp') == ['alpha']
+    other = redis_s.RedisGroupStorage()  # its own index, like the storage of another server
+    other.pop_item('alpha')
+    other.add_item('bravo', Group(perm=1, color='white'))  # the same number of names as before
+
+    deadline = time.monotonic() + 5
+    while groups.search('bra') != ['bravo'] and time.monotonic() < deadline:
+        time.sleep(0.05)  # the change arrives through pub/sub
+    assert groups.search('bra') == ['bravo']
+    assert groups.search('alp') == []
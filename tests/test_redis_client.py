@@ -0,0 +1,104 @@
+import socket
+import threading
+
+import pytest
+from redis.exceptions import ConnectionError
+
+from division.storage import redis_s
+
+
+class DroppingServer:
+    # reads whatever a connection sends and closes it without answering
+    def __init__(self):
+        self.accepted = 0
+        self.received = []
+        self._sock = socket.socket()
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, addr = self._sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            self.received.append(conn.recv(65536))
+            conn.close()
+
+    def close(self):
+        self._sock.close()
+
+
+def client(port: int) -> redis_s.RedisClient:
+    pool = redis_s.RedisConnectionPool(connection_class=redis_s.RedisConnection, max_connections=2, timeout=1,
+                                       host='127.0.0.1', port=port, socket_timeout=1, decode_responses=True)
+    return redis_s.RedisClient(pool, redis_s.Backoff(2, 0.01))
+
+
+@pytest.fixture
+def dropping():
+    server = DroppingServer()
+    yield server
+    server.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_reads_are_retried(dropping):
+    with pytest.raises(ConnectionError):
+        client(dropping.port).execute_command('JSON.GET', 'g-a', '.')
+    assert dropping.accepted == 3
+
+
+def test_writes_that_were_sent_are_not_retried(dropping):
+    with pytest.raises(ConnectionError):
+        client(dropping.port).execute_command('JSON.ARRAPPEND', 'g-a', '.msg', '{}')
+    assert dropping.accepted == 1
+
+
+def test_write_pipelines_that_were_sent_are_not_retried(dropping):
+    pipe = client(dropping.port).pipeline(transaction=False)
+    pipe.jsonarrappend('g-a', redis_s.Path('.msg'), {})
+    pipe.publish(redis_s.INVALIDATE_CHANNEL, 'g-a')
+    with pytest.raises(ConnectionError):
+        pipe.execute()
+    assert dropping.accepted == 1
+
+
+def test_read_pipelines_are_retried_whole(dropping):
+    pipe = client(dropping.port).pipeline(transaction=False)
+    pipe.jsonget('g-a', redis_s.Path.rootPath())
+    pipe.jsonget('g-b', redis_s.Path.rootPath())
+    with pytest.raises(ConnectionError):
+        pipe.execute()
+    assert dropping.accepted == 3
+    assert all(b'g-a' in data and b'g-b' in data for data in dropping.received)
+
+
+def test_writes_are_retried_when_never_sent():
+    retries = []
+    backoff = redis_s.Backoff(2, 0.01)
+
+    def unsent():
+        retries.append(1)
+        raise redis_s.UnsentError('refused')
+
+    with pytest.raises(redis_s.UnsentError):
+        backoff.call(False, unsent)
+    assert len(retries) == 3
+    # a refused connect is raised as unsent by the connection itself
+    with pytest.raises(redis_s.UnsentError):
+        client(free_port()).execute_command('JSON.ARRAPPEND', 'g-a', '.msg', '{}')
+
+
+def test_text_is_sent_as_utf8(dropping):
+    with pytest.raises(ConnectionError):
+        client(dropping.port).jsonset('g-组', redis_s.Path('.text'), '你好')
+    assert '"你好"'.encode('utf8') in dropping.received[0]
@@ -0,0 +1,19 @@
+import lupa
+import pytest
+
+from division.storage import redis_s
+
+SCRIPTS = {name: value for name, value in vars(redis_s).items()
+           if name.isupper() and isinstance(value, str) and 'redis.call' in value}
+
+
+def test_all_scripts_found():
+    assert {'SET_ITEM', 'POP_ITEM', 'JOIN_LEAVE', 'PLACE_ITEM', 'TRIM_MSGS'} <= set(SCRIPTS)
+
+
+@pytest.mark.parametrize('name', sorted(SCRIPTS))
+def test_script_compiles(name):
+    # redis runs each script as the body of a function, load() only parses it
+    check = lupa.LuaRuntime().eval('function(source) local func, error = load(source) return func ~= nil, error end')
+    ok, error = check(SCRIPTS[name])
+    assert ok, f'{name}: {error}'
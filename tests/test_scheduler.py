@@ -0,0 +1,19 @@
+import pytest
+
+import division.entry as entry
+from division.scheduler import Scheduler
+
+
+def test_non_positive_interval_is_rejected():
+    scheduler = Scheduler()
+    for interval in (0, -1):
+        with pytest.raises(ValueError):
+            scheduler.every(interval, lambda: None)
+    scheduler.stop()
+
+
+def test_non_positive_intervals_fall_back_to_the_defaults(start):
+    server = start(presence_flush_interval=0, retention_sweep_interval=-5)
+    assert entry.config.presence_flush_interval == 60
+    assert entry.config.retention_sweep_interval == 3600
+    entry.on_unload(server)
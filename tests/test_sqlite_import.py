@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import division.entry as entry
+from division.storage import sqlite_s
+from division.storage.direct import DirectGroupStorage
+from division.storage.storage import Group
+
+
+def crash_with_journal(server):
+    # changes that only reached the journal, as after the server was killed
+    storage = DirectGroupStorage()
+    storage.load(os.path.join(server.data_folder, 'groups.json'))
+    storage.add_item('broadcast', Group(perm=4, color='gold'))
+    storage.close()
+    storage = DirectGroupStorage()
+    storage.load(os.path.join(server.data_folder, 'groups.json'))
+    storage.add_item('g1', Group(perm=1, color='white'))
+    storage.add_msg('g1', 'alice', 'hello')
+    storage._journal.close()
+    assert os.path.getsize(os.path.join(server.data_folder, 'groups.json.journal')) > 0
+
+
+def test_import_replays_the_journal(server, start):
+    crash_with_journal(server)
+    server = start(storage_format='sqlite')
+    try:
+        assert entry.group_storage.contains('g1')
+        assert [msg.text for msg in entry.group_storage.get('g1').msg] == ['hello']
+    finally:
+        entry.on_unload(server)
+
+
+def test_failed_import_is_tried_again(server, start, monkeypatch):
+    crash_with_journal(server)
+    import_items = sqlite_s.SqliteStorage.import_items
+
+    def fail(self, items):
+        if self.kind == 'g':
+            raise OSError('disk full')
+        import_items(self, items)
+
+    monkeypatch.setattr(sqlite_s.SqliteStorage, 'import_items', fail)
+    with pytest.raises(OSError):
+        start(storage_format='sqlite')
+    entry.executor.stop()
+    monkeypatch.setattr(sqlite_s.SqliteStorage, 'import_items', import_items)
+
+    server = start(storage_format='sqlite')
+    try:
+        assert entry.group_storage.contains('g1')
+        assert [msg.text for msg in entry.group_storage.get('g1').msg] == ['hello']
+    finally:
+        entry.on_unload(server)
@@ -0,0 +1,67 @@
+import pytest
+
+import division.entry as entry
+from division.storage.storage import Group
+
+
+def sweep():
+    entry.sweep_msgs.__wrapped__()
+
+
+def archived(name: str):
+    return [msg.text for msg in entry.archive.iter('group', name)]
+
+
+def kept(name: str):
+    return [msg.text for msg in entry.group_storage.get(name).msg]
+
+
+def add_group(count: int):
+    entry.group_storage.add_item('g1', Group(perm=1, color='white'))
+    for i in range(count):
+        entry.group_storage.add_msg('g1', 'alice', str(i))
+
+
+def test_failed_trim_is_not_archived_twice(start, monkeypatch):
+    server = start(msg_max_count=2)
+    add_group(5)
+    monkeypatch.setattr(entry.group_storage, 'trim_msgs', lambda *args: False)
+    sweep()
+    assert archived('g1') == ['0', '1', '2']
+    assert kept('g1') == ['0', '1', '2', '3', '4']
+    monkeypatch.undo()
+
+    sweep()
+    sweep()
+    assert archived('g1') == ['0', '1', '2']
+    assert kept('g1') == ['3', '4']
+    entry.on_unload(server)
+
+
+def test_failed_archive_keeps_the_messages(start, monkeypatch):
+    server = start(msg_max_count=2)
+    add_group(5)
+
+    def fail(*args):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(entry.archive, 'append', fail)
+    with pytest.raises(OSError):
+        sweep()
+    assert kept('g1') == ['0', '1', '2', '3', '4']
+    entry.on_unload(server)
+
+
+def test_restart_between_archive_and_trim(start, monkeypatch):
+    server = start(msg_max_count=2)
+    add_group(5)
+    monkeypatch.setattr(entry.group_storage, 'trim_msgs', lambda *args: False)
+    sweep()
+    monkeypatch.undo()
+    entry.on_unload(server)
+
+    server = start(msg_max_count=2)  # the archived-up-to time is read back from the archive
+    sweep()
+    assert archived('g1') == ['0', '1', '2']
+    assert kept('g1') == ['3', '4']
+    entry.on_unload(server)